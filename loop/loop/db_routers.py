@@ -0,0 +1,176 @@
+import heapq
+import queue
+import threading
+import zlib
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Iterable, Iterator, TypeVar
+
+from django.conf import settings
+from django.db import connections
+
+T = TypeVar('T')
+
+# models of a store, stored on the shard of their store
+SHARDED_MODELS = {'stores.store', 'stores.storebusinesshour', 'stores.storestatus'}
+
+_read_from_replica: 'ContextVar[bool]' = ContextVar('read_from_replica', default=False)
+
+
+@contextmanager
+def read_from_replica():
+    """
+    Send the reads made within the block to `DATABASE_REPLICA_ALIAS`, for heavy or read only queries (reports) which
+    can tolerate replication lag, so they do not compete with ingestion writes on the primary
+    """
+    token = _read_from_replica.set(True)
+    try:
+        yield
+    finally:
+        _read_from_replica.reset(token)
+
+
+class ReplicaRouter:
+    """
+    Writes always go to the primary (`default`), reads go to the replica only within `read_from_replica()`
+    """
+
+    def db_for_read(self, model, **hints):
+        if _read_from_replica.get():
+            return settings.DATABASE_REPLICA_ALIAS
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replica holds the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default' or db in settings.STORE_SHARDS
+
+
+def get_store_shards() -> 'list[str | None]':
+    """
+    Database aliases of the store shards, `[None]` (default routing) without sharding
+    """
+    return settings.STORE_SHARDS or [None]
+
+
+def get_store_shard(store_id: int) -> 'str | None':
+    """
+    Database alias of the shard of a store (crc32 hash of its id), `None` (default routing) without sharding
+    """
+    shards = settings.STORE_SHARDS
+    if not shards:
+        return None
+    return shards[zlib.crc32(store_id.to_bytes(8, 'little', signed=True)) % len(shards)]
+
+
+def split_by_shard(items: 'Iterable[T]', get_store_id: 'Callable[[T], int]') -> 'dict[str | None, list[T]]':
+    """
+    Group items by the shard of their store, keeping their order
+    """
+    shards: 'dict[str | None, list[T]]' = {}
+    for item in items:
+        shards.setdefault(get_store_shard(get_store_id(item)), []).append(item)
+    return shards
+
+
+_SHARD_DONE = object()
+
+
+def merge_shards(
+        iterate_shard: 'Callable[[str | None], Iterable[T]]', key: 'Callable[[T], object]', buffer_size: int = 1000
+) -> 'Iterator[T]':
+    """
+    Merge the items of `iterate_shard(alias)` (each sorted by `key`) of every shard into one sorted iterator. Shards are
+    read in parallel, one thread (and connection) each, at most `buffer_size` items ahead of the merge. Without
+    sharding the items are read in the calling thread
+    """
+    shards = get_store_shards()
+    if len(shards) == 1:
+        yield from iterate_shard(shards[0])
+        return
+
+    stop = threading.Event()
+
+    def put(items: 'queue.Queue', item) -> bool:
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce(alias: str, items: 'queue.Queue'):
+        try:
+            for item in iterate_shard(alias):
+                if not put(items, item):
+                    return
+            put(items, _SHARD_DONE)
+        except BaseException as e:
+            put(items, e)
+        finally:
+            connections.close_all()
+
+    def consume(items: 'queue.Queue') -> 'Iterator[T]':
+        while True:
+            item = items.get()
+            if item is _SHARD_DONE:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+
+    shard_queues = [queue.Queue(maxsize=buffer_size) for _ in shards]
+    threads = [
+        threading.Thread(target=produce, args=(alias, items), daemon=True)
+        for alias, items in zip(shards, shard_queues)
+    ]
+    for thread in threads:
+        thread.start()
+    try:
+        yield from heapq.merge(*(consume(items) for items in shard_queues), key=key)
+    finally:
+        # consumer stopped early (error, generator closed), release the producers blocked on a full queue
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+
+class ShardRouter:
+    """
+    With `STORE_SHARDS`, stores, business hours and statuses live on the shard of their store (`get_store_shard`).
+    Saves and related lookups are routed through their instance, querysets of these models must pick their shard with
+    `.using(...)`. Other models, and everything without sharding, are left to the next routers
+    """
+
+    @staticmethod
+    def _store_id(obj) -> 'int | None':
+        if obj._meta.label_lower not in SHARDED_MODELS:
+            return None
+        return obj.pk if obj._meta.label_lower == 'stores.store' else obj.store_id
+
+    def _shard(self, model, instance=None) -> 'str | None':
+        if not settings.STORE_SHARDS or model._meta.label_lower not in SHARDED_MODELS or instance is None:
+            return None
+        store_id = self._store_id(instance)
+        return get_store_shard(store_id) if store_id is not None else None
+
+    def db_for_read(self, model, **hints):
+        return self._shard(model, hints.get('instance'))
+
+    def db_for_write(self, model, **hints):
+        return self._shard(model, hints.get('instance'))
+
+    def allow_relation(self, obj1, obj2, **hints):
+        store_id1, store_id2 = self._store_id(obj1), self._store_id(obj2)
+        if settings.STORE_SHARDS and store_id1 is not None and store_id2 is not None:
+            return get_store_shard(store_id1) == get_store_shard(store_id2)
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return None
@@ -11,8 +11,10 @@ https://docs.djangoproject.com/en/4.1/ref/settings/
 """
 
 import os
+from datetime import timedelta
 from pathlib import Path
 
+from celery.schedules import crontab
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -83,6 +85,12 @@ WSGI_APPLICATION = "loop.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/4.1/ref/settings/#databases
 
+# Connections are persistent (`CONN_MAX_AGE` seconds) rather than opened per request / task, set
+# `POSTGRES_CONN_MAX_AGE=0` to close them after each request / task. When `HOST` is a pgbouncer in transaction pooling
+# mode set `POSTGRES_PGBOUNCER=1`, server side cursors do not survive across pooled transactions.
+POSTGRES_CONN_MAX_AGE = int(os.environ.get("POSTGRES_CONN_MAX_AGE", 60))
+POSTGRES_PGBOUNCER = os.environ.get("POSTGRES_PGBOUNCER", "0") == "1"
+
 DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.postgresql",
@@ -91,9 +99,39 @@ DATABASES = {
         "PASSWORD": os.environ["POSTGRES_PASSWORD"],
         "HOST": os.environ["POSTGRES_HOST"],
         "PORT": os.environ["POSTGRES_PORT"],
+        "CONN_MAX_AGE": POSTGRES_CONN_MAX_AGE,
+        "CONN_HEALTH_CHECKS": True,
+        "DISABLE_SERVER_SIDE_CURSORS": POSTGRES_PGBOUNCER,
     }
 }
 
+# Optional read replica, report queries are sent to it (see `loop.db_routers`)
+if os.environ.get("POSTGRES_REPLICA_HOST"):
+    DATABASES["replica"] = {
+        **DATABASES["default"],
+        "HOST": os.environ["POSTGRES_REPLICA_HOST"],
+        "PORT": os.environ.get("POSTGRES_REPLICA_PORT", os.environ["POSTGRES_PORT"]),
+        "TEST": {"MIRROR": "default"},
+    }
+
+DATABASE_REPLICA_ALIAS = "replica" if "replica" in DATABASES else "default"
+
+# Optional store sharding, stores with their business hours and statuses are spread (by store id hash) over the
+# `host[:port][/name]` databases of `POSTGRES_SHARDS` (comma separated), see `loop.db_routers.ShardRouter`
+STORE_SHARDS = []
+for shard_index, shard in enumerate(filter(None, os.environ.get("POSTGRES_SHARDS", "").split(","))):
+    shard_address, _, shard_name = shard.strip().partition("/")
+    shard_host, _, shard_port = shard_address.partition(":")
+    DATABASES[f"shard{shard_index}"] = {
+        **DATABASES["default"],
+        "HOST": shard_host,
+        "PORT": shard_port or os.environ["POSTGRES_PORT"],
+        "NAME": shard_name or os.environ["POSTGRES_DB"],
+    }
+    STORE_SHARDS.append(f"shard{shard_index}")
+
+DATABASE_ROUTERS = ["loop.db_routers.ShardRouter", "loop.db_routers.ReplicaRouter"]
+
 CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.redis.RedisCache',
@@ -137,6 +175,9 @@ STATIC_URL = "static/"
 MEDIA_URL = "media/"
 MEDIA_ROOT = os.path.join(BASE_DIR, "media")
 
+# Columnar archive of closed store status weeks (`python manage.py archive_store_status`)
+STATUS_ARCHIVE_ROOT = os.environ.get("STATUS_ARCHIVE_ROOT") or os.path.join(BASE_DIR, "archive")
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.1/ref/settings/#default-auto-field
 
@@ -147,3 +188,52 @@ CELERY_RESULT_BACKEND = REDIS_CONNECTION_STRING
 
 CELERY_TASK_TRACK_STARTED = True
 CELERY_TASK_TIME_LIMIT = 10 * 60
+# raised in the task ahead of the hard limit, so long tasks (reports) can save their progress
+CELERY_TASK_SOFT_TIME_LIMIT = CELERY_TASK_TIME_LIMIT - 30
+
+# Report generation
+# worker processes used by a single report, `1` computes it in the celery worker process itself
+REPORT_PROCESSES = int(os.environ.get("REPORT_PROCESSES", 1))
+# stores loaded from the database and shipped to a worker process at a time
+REPORT_CHUNK_SIZE = int(os.environ.get("REPORT_CHUNK_SIZE", 200))
+# stores between two saves of the report progress
+REPORT_CHECKPOINT_INTERVAL = int(os.environ.get("REPORT_CHECKPOINT_INTERVAL", 500))
+# attempts of a report after the first one (soft time limit reached)
+REPORT_MAX_RETRIES = int(os.environ.get("REPORT_MAX_RETRIES", 10))
+# how the time between statuses is attributed, see `reports.interpolation.INTERPOLATION_POLICIES`
+REPORT_INTERPOLATION_POLICY = os.environ.get("REPORT_INTERPOLATION_POLICY", "closing_status")
+REPORT_INTERPOLATION_MAX_GAP_MINUTES = (
+    int(os.environ["REPORT_INTERPOLATION_MAX_GAP_MINUTES"])
+    if os.environ.get("REPORT_INTERPOLATION_MAX_GAP_MINUTES") else None
+)
+# days of the daily uptime history tier kept, older ranges are served by the monthly tier
+REPORT_HISTORY_DAY_RETENTION_DAYS = int(os.environ.get("REPORT_HISTORY_DAY_RETENTION_DAYS", 400))
+# the current day of the uptime history is recomputed this often
+REPORT_HISTORY_REFRESH_MINUTES = int(os.environ.get("REPORT_HISTORY_REFRESH_MINUTES", 15))
+
+# run with `celery -A loop beat`
+CELERY_BEAT_SCHEDULE = {
+    "compact-uptime-history": {
+        "task": "reports.tasks.compact_uptime_history",
+        "schedule": crontab(hour=0, minute=30),
+    },
+    "refresh-uptime-history": {
+        "task": "reports.tasks.refresh_uptime_history",
+        "schedule": timedelta(minutes=REPORT_HISTORY_REFRESH_MINUTES),
+    },
+}
+
+# Outage detection (`python manage.py detect_outages`)
+# dotted path of the `stores.outages.AlertSink` alerts are sent to
+OUTAGE_ALERT_SINK = os.environ.get("OUTAGE_ALERT_SINK", "stores.outages.LoggingAlertSink")
+# sliding window and the width of its buckets
+OUTAGE_WINDOW_SECONDS = int(os.environ.get("OUTAGE_WINDOW_SECONDS", 300))
+OUTAGE_BUCKET_SECONDS = int(os.environ.get("OUTAGE_BUCKET_SECONDS", 10))
+# inactive ratio of a timezone group above which an outage is alerted, once the window has enough statuses
+OUTAGE_THRESHOLD = float(os.environ.get("OUTAGE_THRESHOLD", 0.5))
+OUTAGE_MIN_STATUSES = int(os.environ.get("OUTAGE_MIN_STATUSES", 20))
+# per store alerts, disabled unless a threshold is set
+OUTAGE_STORE_THRESHOLD = (
+    float(os.environ["OUTAGE_STORE_THRESHOLD"]) if os.environ.get("OUTAGE_STORE_THRESHOLD") else None
+)
+OUTAGE_STORE_MIN_STATUSES = int(os.environ.get("OUTAGE_STORE_MIN_STATUSES", 1))
@@ -0,0 +1,53 @@
+"""
+Settings for load testing the API locally (`python manage.py loadtest_api`), without the production services:
+
+- database: sqlite file, or the configured postgres with `LOADTEST_POSTGRES=1`
+- store shards: `LOADTEST_SHARDS=<n>` sqlite shard files next to the sqlite database, or the configured
+  `POSTGRES_SHARDS` with `LOADTEST_POSTGRES=1`
+- celery: in memory broker and result backend, or the configured redis with `LOADTEST_REDIS=1`, tasks run inline in
+  the web process with `LOADTEST_EAGER=1` (otherwise nothing consumes them and they stay pending)
+"""
+import os
+
+# required by the base settings, not needed by the local stand-ins
+os.environ.setdefault("DJANGO_SECRET_KEY", "loadtest")
+for name in ["REDIS_CONNECTION_STRING", "POSTGRES_DB", "POSTGRES_USER", "POSTGRES_PASSWORD", "POSTGRES_HOST",
+             "POSTGRES_PORT"]:
+    os.environ.setdefault(name, "")
+
+from .settings import *  # noqa: E402,F401,F403
+from .settings import BASE_DIR, DATABASES, REDIS_CONNECTION_STRING, STORE_SHARDS  # noqa: E402
+
+DEBUG = False
+ALLOWED_HOSTS = ["127.0.0.1", "localhost"]
+
+if os.environ.get("LOADTEST_POSTGRES") != "1":
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": BASE_DIR / "loadtest.sqlite3",
+        }
+    }
+    STORE_SHARDS = [f"shard{shard_index}" for shard_index in range(int(os.environ.get("LOADTEST_SHARDS", 0)))]
+    for shard in STORE_SHARDS:
+        DATABASES[shard] = {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": BASE_DIR / f"loadtest_{shard}.sqlite3",
+        }
+else:
+    DATABASES = {"default": DATABASES["default"], **{shard: DATABASES[shard] for shard in STORE_SHARDS}}
+DATABASE_REPLICA_ALIAS = "default"
+
+if os.environ.get("LOADTEST_REDIS") != "1":
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
+    }
+    CELERY_BROKER_URL = "memory://"
+    CELERY_RESULT_BACKEND = "cache+memory://"
+else:
+    CELERY_BROKER_URL = REDIS_CONNECTION_STRING
+    CELERY_RESULT_BACKEND = REDIS_CONNECTION_STRING
+
+CELERY_TASK_ALWAYS_EAGER = os.environ.get("LOADTEST_EAGER") == "1"
@@ -0,0 +1,245 @@
+"""
+Downsampled uptime history, RRD style tiers of business hours uptime per store:
+
+- day: UTC days, computed from the raw statuses (from the status archive for archived weeks)
+- month: UTC months, compacted from the days once the month is closed
+
+Days are kept for `REPORT_HISTORY_DAY_RETENTION_DAYS`, months for good. Queries read the coarsest tier covering the
+requested range, their cost depends on the number of periods and stores, not on how far back they go. The current day
+is refreshed periodically as a partial day, queries never read the raw statuses.
+"""
+from datetime import date, datetime, time, timedelta, timezone
+from itertools import chain
+from typing import Iterator
+
+from django.conf import settings
+from django.db.models import Count, DateField, F, Sum
+from django.db.models.functions import TruncMonth
+
+from loop.db_routers import get_store_shards, read_from_replica
+from reports.interpolation import InterpolationPolicy
+from reports.models import StoreUptimeAggregate
+from reports.parallel import iter_store_chunks
+from reports.utils import accumulate_uptime_downtime, clip_shifts
+from stores.archive import StatusArchive
+from stores.models import Store
+from stores.utils import StoreBusinessHourHelper, prepare_timezone_offsets
+
+DAY = StoreUptimeAggregate.Resolution.DAY
+MONTH = StoreUptimeAggregate.Resolution.MONTH
+
+AGGREGATE_FIELDS = ['uptime_seconds', 'downtime_seconds', 'unknown_seconds']
+
+
+def get_month_start(day: date) -> date:
+    return day.replace(day=1)
+
+
+def get_next_month(day: date) -> date:
+    return (day.replace(day=1) + timedelta(days=32)).replace(day=1)
+
+
+def save_aggregates(aggregates: 'list[StoreUptimeAggregate]'):
+    # recomputing a period replaces it
+    StoreUptimeAggregate.objects.bulk_create(
+        aggregates,
+        batch_size=1000,
+        update_conflicts=True,
+        unique_fields=['resolution', 'period_start', 'store_id'],
+        update_fields=AGGREGATE_FIELDS,
+    )
+
+
+def iter_day_aggregates(
+        day: date,
+        chunk_size: int,
+        policy: 'InterpolationPolicy | None' = None,
+        until: 'datetime | None' = None,
+        archive: 'StatusArchive | None' = None,
+) -> 'Iterator[list[StoreUptimeAggregate]]':
+    """
+    Day tier of every store for the UTC day from the raw statuses, read from the `archive` if given, one list of unsaved
+    aggregates per chunk of stores. A day still open is computed `until` the given datetime
+    """
+    start_datetime = datetime.combine(day, time.min, timezone.utc)
+    end_datetime = start_datetime + timedelta(days=1)
+    if until is not None:
+        end_datetime = min(end_datetime, until)
+    chunks = chain.from_iterable(
+        iter_store_chunks(end_datetime, chunk_size, period=end_datetime - start_datetime, using=using, archive=archive)
+        for using in get_store_shards()
+    )
+    for chunk in chunks:
+        prepare_timezone_offsets({timezone_str for _, timezone_str, _, _ in chunk}, day - timedelta(days=1), day)
+        aggregates = []
+        for store_id, timezone_str, business_hours, status_list in chunk:
+            helper = StoreBusinessHourHelper(
+                store=Store(store_id=store_id, timezone_str=timezone_str),
+                business_hours=business_hours,
+            )
+            # whole shifts overlapping the UTC day, they can start the day before or end the day after
+            shifts = clip_shifts(
+                helper.shifts_generator(start_datetime, end_datetime),
+                start_datetime,
+                end_datetime,
+            )
+            uptime, downtime, unknown = accumulate_uptime_downtime(status_list, shifts, policy)
+            aggregates.append(StoreUptimeAggregate(
+                store_id=store_id,
+                resolution=DAY,
+                period_start=day,
+                uptime_seconds=uptime.total_seconds(),
+                downtime_seconds=downtime.total_seconds(),
+                unknown_seconds=unknown.total_seconds(),
+            ))
+        yield aggregates
+
+
+def compute_day(
+        day: date, chunk_size: int, policy: 'InterpolationPolicy | None' = None, until: 'datetime | None' = None
+) -> int:
+    """
+    Compute the day tier of every store for the UTC day from the raw statuses, read from the status archive
+    (`STATUS_ARCHIVE_ROOT`) once its week is archived, returns the number of stores. The current day is computed
+    `until` the given datetime, the partial day is replaced by later refreshes and by the day once closed
+    """
+    start_datetime = datetime.combine(day, time.min, timezone.utc)
+    archive = StatusArchive(settings.STATUS_ARCHIVE_ROOT)
+    total = 0
+    try:
+        with read_from_replica():
+            day_archive = archive if archive.is_archived(start_datetime, start_datetime + timedelta(days=1)) else None
+            for aggregates in iter_day_aggregates(day, chunk_size, policy, until=until, archive=day_archive):
+                save_aggregates(aggregates)
+                total += len(aggregates)
+    finally:
+        archive.close()
+    return total
+
+
+def compact_month(month_start: date) -> int:
+    """
+    Compact the days of the month into the month tier, returns the number of stores
+    """
+    days = StoreUptimeAggregate.objects.filter(
+        resolution=DAY, period_start__gte=month_start, period_start__lt=get_next_month(month_start),
+    ).values('store_id').annotate(**{field: Sum(field) for field in AGGREGATE_FIELDS}).order_by('store_id')
+    aggregates = [
+        StoreUptimeAggregate(resolution=MONTH, period_start=month_start, **values)
+        for values in days
+    ]
+    save_aggregates(aggregates)
+    return len(aggregates)
+
+
+def prune_days(before: date) -> int:
+    """
+    Drop the days before `before`, their months are compacted already
+    """
+    deleted, _ = StoreUptimeAggregate.objects.filter(resolution=DAY, period_start__lt=before).delete()
+    return deleted
+
+
+def build_history(
+        start_date: date, end_date: date, chunk_size: int, policy: 'InterpolationPolicy | None' = None
+) -> 'list[date]':
+    """
+    Compute the days from start_date to end_date (inclusive) and compact the months ending within them, the days of
+    these months before start_date must be computed already. Returns the compacted months
+    """
+    day = start_date
+    while day <= end_date:
+        compute_day(day, chunk_size, policy)
+        day += timedelta(days=1)
+
+    months = []
+    month_start = get_month_start(start_date)
+    while get_next_month(month_start) - timedelta(days=1) <= end_date:
+        compact_month(month_start)
+        months.append(month_start)
+        month_start = get_next_month(month_start)
+    return months
+
+
+def get_history_resolution(start_date: date, end_date: date, today: date) -> str:
+    """
+    Coarsest tier covering the range: months for whole months, otherwise days, unless they are not retained anymore
+    """
+    if start_date.day == 1 and (end_date + timedelta(days=1)).day == 1:
+        return MONTH
+    if start_date < today - timedelta(days=settings.REPORT_HISTORY_DAY_RETENTION_DAYS):
+        return MONTH
+    return DAY
+
+
+def get_timezone_store_ids(timezone_str: str) -> 'list[int]':
+    return [
+        store_id
+        for using in get_store_shards()
+        for store_id in Store.objects.using(using).filter(timezone_str=timezone_str).values_list('store_id', flat=True)
+    ]
+
+
+def get_history(
+        start_date: date,
+        end_date: date,
+        today: date,
+        store_ids: 'list[int] | None' = None,
+        timezone_str: 'str | None' = None,
+        resolution: 'str | None' = None,
+) -> 'tuple[str, list[dict]]':
+    """
+    Uptime history from start_date to end_date (inclusive), summed over the given stores and / or the stores of a
+    timezone (whole fleet by default). Returns the resolution and one point per period, a month point only counts the
+    days of the month within the range.
+
+    Whole compacted months are read from the month tier, other months from the days within the range. Only stored
+    tiers are read: the current day is served as last refreshed (`refresh_uptime_history`), days not computed yet have
+    no point. Days past their retention are only left in their months, a partial month past the retention has no point
+    """
+    resolution = resolution or get_history_resolution(start_date, end_date, today)
+
+    aggregates = StoreUptimeAggregate.objects.all()
+    if store_ids:
+        aggregates = aggregates.filter(store_id__in=store_ids)
+    if timezone_str:
+        if not settings.STORE_SHARDS:
+            aggregates = aggregates.filter(
+                store_id__in=Store.objects.filter(timezone_str=timezone_str).values('store_id')
+            )
+        else:
+            # stores are on other databases than the aggregates, no subquery
+            aggregates = aggregates.filter(store_id__in=get_timezone_store_ids(timezone_str))
+
+    days = aggregates.filter(resolution=DAY, period_start__gte=start_date, period_start__lte=end_date)
+    months: 'set[date]' = set()
+    if resolution == MONTH:
+        month_starts = StoreUptimeAggregate.objects.filter(
+            resolution=MONTH, period_start__gte=start_date, period_start__lte=end_date,
+        ).values_list('period_start', flat=True).distinct()
+        months = {
+            month_start for month_start in month_starts if get_next_month(month_start) - timedelta(days=1) <= end_date
+        }
+        days = days.annotate(period=TruncMonth('period_start', output_field=DateField()))
+    else:
+        days = days.annotate(period=F('period_start'))
+
+    points: 'dict[date, dict]' = {}
+    for point in chain(
+            aggregates.filter(resolution=MONTH, period_start__in=months).annotate(period=F('period_start'))
+            .values('period').annotate(stores=Count('store_id'), **{field: Sum(field) for field in AGGREGATE_FIELDS}),
+            days.exclude(period__in=months).values('period')
+            .annotate(stores=Count('store_id', distinct=True), **{field: Sum(field) for field in AGGREGATE_FIELDS}),
+    ):
+        points[point.pop('period')] = point
+
+    return resolution, [
+        {
+            'period_start': period_start,
+            'stores': point['stores'],
+            'uptime_hours': point['uptime_seconds'] / 3600,
+            'downtime_hours': point['downtime_seconds'] / 3600,
+            'unknown_hours': point['unknown_seconds'] / 3600,
+        }
+        for period_start, point in sorted(points.items())
+    ]
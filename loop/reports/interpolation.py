@@ -0,0 +1,99 @@
+"""
+Interpolation policies, how the time between the polls of a shift is attributed to uptime, downtime or unknown.
+
+A shift is split into segments by its statuses: shift start to first status, status to status, last status to shift
+end (or the whole shift when it has no status). A policy attributes each segment from the statuses on either side of it.
+"""
+from datetime import timedelta
+from typing import Callable
+
+ZERO = timedelta()
+
+
+class InterpolationPolicy:
+    def attribute(
+            self, duration: timedelta, before: 'bool | None', after: 'bool | None'
+    ) -> (timedelta, timedelta, timedelta):
+        """
+        Split a segment of `duration` into `(uptime, downtime, unknown)`, `before` / `after` are the `is_active` of the
+        statuses on either side, `None` at the shift boundaries
+        """
+        raise NotImplementedError
+
+
+def _attribute_to(duration: timedelta, is_active: 'bool | None') -> (timedelta, timedelta, timedelta):
+    if is_active is None:
+        return ZERO, ZERO, duration
+    if is_active:
+        return duration, ZERO, ZERO
+    return ZERO, duration, ZERO
+
+
+class ClosingStatusPolicy(InterpolationPolicy):
+    """
+    Each segment takes the status closing it, the last one the status opening it. A shift without status is downtime
+    """
+
+    def attribute(self, duration, before, after):
+        if before is None and after is None:
+            return ZERO, duration, ZERO
+        return _attribute_to(duration, after if after is not None else before)
+
+
+class CarryForwardPolicy(InterpolationPolicy):
+    """
+    A status holds for at most `max_gap` after it, the rest of the segment (and the time before the first status) is
+    unknown
+    """
+
+    def __init__(self, max_gap: 'timedelta | None'):
+        if max_gap is None:
+            raise ValueError('Carry forward interpolation requires a max gap')
+        self.max_gap = max_gap
+
+    def attribute(self, duration, before, after):
+        carried = min(duration, self.max_gap)
+        uptime, downtime, unknown = _attribute_to(carried, before)
+        return uptime, downtime, unknown + duration - carried
+
+
+class MidpointPolicy(InterpolationPolicy):
+    """
+    A segment is split at its midpoint, each half takes the status on its side (the status on the only side at the
+    shift boundaries). Each status covers at most `max_gap` (if set) of a half, the rest is unknown. A shift without
+    status is unknown
+    """
+
+    def __init__(self, max_gap: 'timedelta | None' = None):
+        self.max_gap = max_gap
+
+    def _cover(self, duration: timedelta, is_active: 'bool | None') -> (timedelta, timedelta, timedelta):
+        covered = duration if self.max_gap is None else min(duration, self.max_gap)
+        uptime, downtime, unknown = _attribute_to(covered, is_active)
+        return uptime, downtime, unknown + duration - covered
+
+    def attribute(self, duration, before, after):
+        if before is None:
+            return self._cover(duration, after)
+        if after is None:
+            return self._cover(duration, before)
+        first_half = duration / 2
+        uptime_before, downtime_before, unknown_before = self._cover(first_half, before)
+        uptime_after, downtime_after, unknown_after = self._cover(duration - first_half, after)
+        return uptime_before + uptime_after, downtime_before + downtime_after, unknown_before + unknown_after
+
+
+# name: factory taking the max gap (`None` when not configured)
+INTERPOLATION_POLICIES: 'dict[str, Callable[[timedelta | None], InterpolationPolicy]]' = {
+    'closing_status': lambda max_gap: ClosingStatusPolicy(),
+    'carry_forward': CarryForwardPolicy,
+    'midpoint': MidpointPolicy,
+}
+
+
+def get_interpolation_policy(name: str, max_gap_minutes: 'int | None' = None) -> InterpolationPolicy:
+    try:
+        factory = INTERPOLATION_POLICIES[name]
+    except KeyError:
+        raise ValueError(f'Unknown interpolation policy: {name}')
+    return factory(None if max_gap_minutes is None else timedelta(minutes=max_gap_minutes))
@@ -0,0 +1,26 @@
+from datetime import date
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from reports.history import build_history
+from reports.interpolation import get_interpolation_policy
+
+
+class Command(BaseCommand):
+    help = 'Backfill the uptime history tiers, the scheduled compact_uptime_history task keeps them up to date'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', type=date.fromisoformat, required=True, help='first UTC day (ISO format)')
+        parser.add_argument('--end', type=date.fromisoformat, required=True, help='last UTC day (ISO format)')
+
+    def handle(self, *args, **options):
+        if options['start'] > options['end']:
+            raise CommandError('--start must not be after --end')
+
+        policy = get_interpolation_policy(
+            settings.REPORT_INTERPOLATION_POLICY, settings.REPORT_INTERPOLATION_MAX_GAP_MINUTES
+        )
+        months = build_history(options['start'], options['end'], settings.REPORT_CHUNK_SIZE, policy)
+        days = (options['end'] - options['start']).days + 1
+        self.stdout.write(self.style.SUCCESS(f'Successfully built {days} days and {len(months)} months'))
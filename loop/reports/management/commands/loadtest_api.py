@@ -0,0 +1,213 @@
+import http.client
+import json
+import math
+import multiprocessing
+import os
+import random
+import socket
+import threading
+import time
+import uuid
+from collections import defaultdict
+from urllib.parse import urlencode
+
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+from django.db import connection
+
+from reports.models import StoreReport
+
+TRIGGER = 'trigger/'
+GET_REPORT = 'get_report/'
+
+
+class QuietWSGIRequestHandler(WSGIRequestHandler):
+    # headers and body are written separately, with nagle every keep alive response waits for a delayed ack
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+
+def percentile(sorted_values: 'list[float]', p: float) -> float:
+    """
+    Nearest rank percentile of already sorted values
+    """
+    if not sorted_values:
+        return 0
+    return sorted_values[max(0, math.ceil(p / 100 * len(sorted_values)) - 1)]
+
+
+class LoadClient:
+    """
+    HTTP client of a load test thread, keeps its connection alive and records the latency of every request
+    """
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.connection = None
+        # endpoint: [(latency in seconds, success)]
+        self.results: 'dict[str, list[tuple[float, bool]]]' = defaultdict(list)
+
+    def request(self, method: str, endpoint: str, params: 'dict | None' = None) -> 'dict | None':
+        url = f'/reports/{endpoint}'
+        if params:
+            url = f'{url}?{urlencode(params)}'
+        started = time.perf_counter()
+        try:
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection(self.host, self.port, timeout=30)
+                self.connection.connect()
+                self.connection.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.connection.request(method, url)
+            response = self.connection.getresponse()
+            body = response.read()
+            success = response.status == 200
+        except (OSError, http.client.HTTPException):
+            self.connection = None
+            body, success = None, False
+        self.results[endpoint].append((time.perf_counter() - started, success))
+        return json.loads(body) if success else None
+
+
+def run_clients(
+        host: str, port: int, pollers: int, triggers: int, report_ids: 'list[str]', duration: float
+) -> 'tuple[dict[str, list[tuple[float, bool]]], list[str]]':
+    """
+    Run `pollers` get_report and `triggers` trigger client threads for `duration` seconds, in a client process. Returns
+    the results per endpoint and the triggered report ids
+    """
+    report_ids = list(report_ids)
+    triggered_ids = []
+    deadline = time.monotonic() + duration
+
+    def poll(client: LoadClient):
+        while time.monotonic() < deadline:
+            if not report_ids:
+                time.sleep(0.01)
+                continue
+            client.request('GET', GET_REPORT, {'report_id': random.choice(report_ids)})
+
+    def trigger(client: LoadClient):
+        while time.monotonic() < deadline:
+            data = client.request('POST', TRIGGER)
+            if data:
+                # list append is atomic, pollers pick up triggered (pending / running) reports too
+                report_ids.append(data['report_id'])
+                triggered_ids.append(data['report_id'])
+
+    clients = []
+    threads = []
+    for target, count in ((poll, pollers), (trigger, triggers)):
+        for _ in range(count):
+            client = LoadClient(host, port)
+            clients.append(client)
+            threads.append(threading.Thread(target=target, args=(client,)))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    results: 'dict[str, list[tuple[float, bool]]]' = defaultdict(list)
+    for client in clients:
+        for endpoint, endpoint_results in client.results.items():
+            results[endpoint].extend(endpoint_results)
+    return dict(results), triggered_ids
+
+
+def split_evenly(count: int, parts: int) -> 'list[int]':
+    return [count // parts + (i < count % parts) for i in range(parts)]
+
+
+class Command(BaseCommand):
+    help = 'Load test the trigger / get_report API, run with `--settings=loop.settings_loadtest` for local stand-ins'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pollers', type=int, default=50, help='concurrent get_report clients')
+        parser.add_argument('--triggers', type=int, default=2, help='concurrent trigger clients')
+        parser.add_argument('--duration', type=float, default=10, help='seconds')
+        parser.add_argument('--completed', type=int, default=20, help='completed reports seeded for the pollers')
+        parser.add_argument(
+            '--client-processes', type=int,
+            help='processes running the clients, apart from the server process (defaults to the number of cpus)',
+        )
+        parser.add_argument(
+            '--max-p99-ms', type=float,
+            help='fail if the p99 latency of an endpoint is above this, to catch regressions before deploy',
+        )
+
+    def handle(self, *args, **options):
+        report_ids = self.seed(options['completed'])
+        # seeding connection is not used by the request threads, nor inherited by the client processes
+        connection.close()
+
+        server = ThreadedWSGIServer(('127.0.0.1', 0), QuietWSGIRequestHandler)
+        server.daemon_threads = True
+        server.set_app(WSGIHandler())
+        host, port = server.server_address[:2]
+
+        # clients run in their own processes, so the latencies measure the app and not the GIL contention of hundreds
+        # of client threads with the server. Forked before the server thread starts, connections wait in the backlog
+        client_processes = max(1, min(
+            options['client_processes'] or os.cpu_count() or 1, options['pollers'] + options['triggers']
+        ))
+        with multiprocessing.get_context('fork').Pool(client_processes) as pool:
+            server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+            server_thread.start()
+
+            started = time.monotonic()
+            client_results = pool.starmap(run_clients, [
+                (host, port, pollers, triggers, report_ids, options['duration'])
+                for pollers, triggers in zip(
+                    split_evenly(options['pollers'], client_processes),
+                    split_evenly(options['triggers'], client_processes),
+                )
+            ])
+            elapsed = time.monotonic() - started
+
+        server.shutdown()
+        server.server_close()
+
+        results: 'dict[str, list[tuple[float, bool]]]' = defaultdict(list)
+        for process_results, triggered_ids in client_results:
+            for endpoint, endpoint_results in process_results.items():
+                results[endpoint].extend(endpoint_results)
+            report_ids.extend(triggered_ids)
+        # reports generated by eager triggers too
+        self.cleanup(report_ids)
+
+        self.stdout.write(
+            f'{"endpoint":<12} {"requests":>9} {"errors":>7} {"req/s":>9} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9}'
+        )
+        failed = []
+        for endpoint in (TRIGGER, GET_REPORT):
+            latencies = sorted(latency * 1000 for latency, _ in results[endpoint])
+            errors = sum(1 for _, success in results[endpoint] if not success)
+            p99 = percentile(latencies, 99)
+            self.stdout.write(
+                f'{endpoint:<12} {len(latencies):>9} {errors:>7} {len(latencies) / elapsed:>9.1f} '
+                f'{percentile(latencies, 50):>9.1f} {percentile(latencies, 95):>9.1f} {p99:>9.1f}'
+            )
+            if errors or (options['max_p99_ms'] is not None and p99 > options['max_p99_ms']):
+                failed.append(endpoint)
+
+        if failed:
+            raise CommandError(f'Load test failed for: {", ".join(failed)}')
+        self.stdout.write(self.style.SUCCESS('Load test passed'))
+
+    def seed(self, count: int) -> 'list[str]':
+        report_ids = []
+        for _ in range(count):
+            report = StoreReport(report_id=uuid.uuid4())
+            report.set_content(b'store_id,uptime_last_hour\n1,60\n')
+            report.save(force_insert=True)
+            report_ids.append(str(report.report_id))
+        return report_ids
+
+    def cleanup(self, report_ids: 'list[str]'):
+        for report in StoreReport.objects.filter(report_id__in=report_ids):
+            report.file.delete(save=False)
+            report.gzip_file.delete(save=False)
+            report.delete()
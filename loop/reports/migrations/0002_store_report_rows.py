@@ -0,0 +1,55 @@
+# Generated by Django 4.1.7 on 2026-10-19 03:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("reports", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StoreReportCheckpoint",
+            fields=[
+                (
+                    "report_id",
+                    models.UUIDField(editable=False, primary_key=True, serialize=False),
+                ),
+                ("last_store_id", models.BigIntegerField()),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="StoreReportRow",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("report_id", models.UUIDField(editable=False)),
+                ("store_id", models.BigIntegerField()),
+                ("uptime_last_hour", models.FloatField()),
+                ("downtime_last_hour", models.FloatField()),
+                ("uptime_last_day", models.FloatField()),
+                ("downtime_last_day", models.FloatField()),
+                ("uptime_last_week", models.FloatField()),
+                ("downtime_last_week", models.FloatField()),
+                ("unknown_last_hour", models.FloatField()),
+                ("unknown_last_day", models.FloatField()),
+                ("unknown_last_week", models.FloatField()),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="storereportrow",
+            constraint=models.UniqueConstraint(
+                fields=("report_id", "store_id"), name="unique_report_store"
+            ),
+        ),
+    ]
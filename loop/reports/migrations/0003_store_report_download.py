@@ -0,0 +1,23 @@
+# Generated by Django 4.1.7 on 2026-10-19 03:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("reports", "0002_store_report_rows"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="storereport",
+            name="content_hash",
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name="storereport",
+            name="gzip_file",
+            field=models.FileField(blank=True, upload_to="reports"),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 4.1.7 on 2026-10-19 03:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("reports", "0003_store_report_download"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StoreUptimeAggregate",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("store_id", models.BigIntegerField()),
+                (
+                    "resolution",
+                    models.CharField(
+                        choices=[("day", "Day"), ("month", "Month")], max_length=5
+                    ),
+                ),
+                ("period_start", models.DateField()),
+                ("uptime_seconds", models.FloatField()),
+                ("downtime_seconds", models.FloatField()),
+                ("unknown_seconds", models.FloatField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="storeuptimeaggregate",
+            index=models.Index(
+                fields=["store_id", "resolution", "period_start"],
+                name="aggregate_store_period",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="storeuptimeaggregate",
+            constraint=models.UniqueConstraint(
+                fields=("resolution", "period_start", "store_id"),
+                name="unique_aggregate_period",
+            ),
+        ),
+    ]
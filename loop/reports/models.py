@@ -1,7 +1,111 @@
-from django.db import models
+import gzip
+import hashlib
+import tempfile
+
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.db import models, transaction
 
 
 class StoreReport(models.Model):
     report_id = models.UUIDField(primary_key=True, editable=False)
 
     file = models.FileField(upload_to='reports')
+    # gzip copy of `file`, served to clients accepting gzip
+    gzip_file = models.FileField(upload_to='reports', blank=True)
+    # sha256 of `file`, used as strong ETag
+    content_hash = models.CharField(max_length=64, blank=True)
+
+    def set_content(self, content: bytes):
+        """
+        Set the csv file of the report along with its gzip copy and content hash
+        """
+        self.content_hash = hashlib.sha256(content).hexdigest()
+        self.file = ContentFile(content, name=f'{self.report_id}.csv')
+        # no mtime in the header, the same content always gives the same gzip file
+        self.gzip_file = ContentFile(gzip.compress(content, mtime=0), name=f'{self.report_id}.csv.gz')
+
+    def prepare_download(self):
+        """
+        Compute the gzip copy and content hash of reports generated before they existed, streaming the file. Concurrent
+        first downloads wait on the row lock, the first one writes the artifacts and the others reuse them
+        """
+        if self.content_hash and self.gzip_file:
+            return
+
+        with transaction.atomic():
+            report = StoreReport.objects.select_for_update().get(pk=self.pk)
+            if not (report.content_hash and report.gzip_file):
+                content_hash = hashlib.sha256()
+                with tempfile.TemporaryFile() as gzip_io:
+                    with report.file.open('rb') as f, \
+                            gzip.GzipFile(fileobj=gzip_io, mode='wb', mtime=0) as gzip_writer:
+                        for chunk in f.chunks():
+                            content_hash.update(chunk)
+                            gzip_writer.write(chunk)
+                    gzip_io.seek(0)
+                    report.content_hash = content_hash.hexdigest()
+                    report.gzip_file.save(f'{report.report_id}.csv.gz', File(gzip_io), save=False)
+                report.save(update_fields=['content_hash', 'gzip_file'])
+        self.content_hash = report.content_hash
+        self.gzip_file = report.gzip_file
+
+
+class StoreReportRow(models.Model):
+    """
+    Report row of a store, saved as the report is generated so an interrupted report resumes where it stopped, and kept
+    once completed for lookups without the csv file (unique constraint doubles as the `(report_id, store_id)` index)
+    """
+    report_id = models.UUIDField(editable=False)
+    store_id = models.BigIntegerField()
+
+    uptime_last_hour = models.FloatField()
+    downtime_last_hour = models.FloatField()
+    uptime_last_day = models.FloatField()
+    downtime_last_day = models.FloatField()
+    uptime_last_week = models.FloatField()
+    downtime_last_week = models.FloatField()
+    unknown_last_hour = models.FloatField()
+    unknown_last_day = models.FloatField()
+    unknown_last_week = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['report_id', 'store_id'], name='unique_report_store'),
+        ]
+
+
+class StoreReportCheckpoint(models.Model):
+    """
+    Progress of a report being generated, rows of every store up to `last_store_id` are saved
+    """
+    report_id = models.UUIDField(primary_key=True, editable=False)
+    last_store_id = models.BigIntegerField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+class StoreUptimeAggregate(models.Model):
+    """
+    Business hours uptime, downtime and unknown seconds of a store over a UTC day or month, see `reports.history`
+    """
+
+    class Resolution(models.TextChoices):
+        DAY = 'day', 'Day'
+        MONTH = 'month', 'Month'
+
+    store_id = models.BigIntegerField()
+    resolution = models.CharField(max_length=5, choices=Resolution.choices)
+    period_start = models.DateField()
+
+    uptime_seconds = models.FloatField()
+    downtime_seconds = models.FloatField()
+    unknown_seconds = models.FloatField()
+
+    class Meta:
+        constraints = [
+            # doubles as the index of fleet / region queries
+            models.UniqueConstraint(fields=['resolution', 'period_start', 'store_id'], name='unique_aggregate_period'),
+        ]
+        indexes = [
+            models.Index(fields=['store_id', 'resolution', 'period_start'], name='aggregate_store_period'),
+        ]
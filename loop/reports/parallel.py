@@ -0,0 +1,141 @@
+"""
+Process pool execution of the report, the uptime / downtime math is CPU bound and limited to one core by the GIL.
+
+Only the parent process talks to the database: it loads stores, business hours and statuses in bulk, one chunk of stores
+at a time, and ships them as plain tuples to the worker processes, so database connections stay at one per report
+(one per shard with store sharding) however many processes are used.
+"""
+import logging
+from collections import defaultdict, deque
+from datetime import datetime, timedelta
+from typing import Iterator
+
+import billiard
+from django.db import connections
+
+from loop.db_routers import merge_shards
+from stores.archive import StatusArchive
+from stores.models import Store, StoreBusinessHour, StoreStatus
+from stores.utils import StoreBusinessHourHelper, group_stores_by_timezone, prepare_timezone_offsets
+from .interpolation import InterpolationPolicy
+from .utils import StoreReportDict, build_store_report
+
+logger = logging.getLogger(__name__)
+
+
+def iter_store_chunks(
+        from_datetime: datetime,
+        chunk_size: int,
+        after_store_id: 'int | None' = None,
+        period: timedelta = timedelta(weeks=1),
+        using: 'str | None' = None,
+        archive: 'StatusArchive | None' = None,
+) -> 'Iterator[list[tuple]]':
+    """
+    Load stores (after `after_store_id` if given) in chunks of `chunk_size`, with their business hours and statuses of
+    the `period` (last week by default) before from_datetime in bulk (one query per chunk for each). Each item is
+    `(store_id, timezone_str, business_hours, status_list)`, with business hours as `day`, `start_time_local`,
+    `end_time_local` dicts and statuses as `(timestamp_utc, is_active)` ordered by timestamp. Only the stores of the
+    database `using` (a shard) if given. Statuses are read from the columnar `archive` instead of the database if given,
+    its status lists are memory mapped and stay in this process
+    """
+    stores = Store.objects.using(using).order_by('store_id')
+    if after_store_id is not None:
+        stores = stores.filter(store_id__gt=after_store_id)
+    stores = list(stores.values_list('store_id', 'timezone_str'))
+
+    for i in range(0, len(stores), chunk_size):
+        chunk = stores[i:i + chunk_size]
+        store_ids = [store_id for store_id, _ in chunk]
+
+        business_hours: 'dict[int, list[dict]]' = defaultdict(list)
+        for b_hour in StoreBusinessHour.objects.using(using).filter(store_id__in=store_ids) \
+                .order_by('store_id', 'day', 'start_time_local') \
+                .values('store_id', 'day', 'start_time_local', 'end_time_local'):
+            business_hours[b_hour.pop('store_id')].append(b_hour)
+
+        if archive is not None:
+            yield [
+                (
+                    store_id, timezone_str, business_hours[store_id],
+                    archive.status_list(store_id, from_datetime - period, from_datetime),
+                )
+                for store_id, timezone_str in chunk
+            ]
+            continue
+
+        statuses: 'dict[int, list[tuple[datetime, bool]]]' = defaultdict(list)
+        for store_id, timestamp_utc, is_active in StoreStatus.objects.using(using).filter(
+                store_id__in=store_ids,
+                timestamp_utc__gte=from_datetime - period,
+                timestamp_utc__lte=from_datetime,
+        ).order_by('store_id', 'timestamp_utc').values_list('store_id', 'timestamp_utc', 'is_active'):
+            statuses[store_id].append((timestamp_utc, is_active))
+
+        yield [
+            (store_id, timezone_str, business_hours[store_id], statuses[store_id])
+            for store_id, timezone_str in chunk
+        ]
+
+
+def compute_store_chunk(
+        from_datetime: datetime, chunk: 'list[tuple]', policy: 'InterpolationPolicy | None' = None
+) -> 'list[StoreReportDict]':
+    """
+    Compute the report rows of a chunk of stores, runs in the worker processes without any database access
+    """
+    stores_by_timezone = group_stores_by_timezone((store_id, timezone_str) for store_id, timezone_str, _, _ in chunk)
+    prepare_timezone_offsets(stores_by_timezone, (from_datetime - timedelta(weeks=1)).date(), from_datetime.date())
+
+    reports: 'list[StoreReportDict]' = []
+    for store_id, timezone_str, business_hours, status_list in chunk:
+        # unsaved instance, only used to carry the timezone
+        helper = StoreBusinessHourHelper(
+            store=Store(store_id=store_id, timezone_str=timezone_str),
+            business_hours=business_hours,
+        )
+        reports.append(build_store_report(from_datetime, helper, status_list, policy))
+    return reports
+
+
+def _init_worker():
+    import django
+    from django.apps import apps
+
+    # workers started with `spawn` do not inherit the configured django
+    if not apps.ready:
+        django.setup()
+
+
+def generate_store_reports_parallel(
+        from_datetime: datetime,
+        processes: int,
+        chunk_size: int,
+        policy: 'InterpolationPolicy | None' = None,
+        after_store_id: 'int | None' = None,
+) -> 'Iterator[StoreReportDict]':
+    """
+    Generate report rows of all stores (after `after_store_id` if given, ordered by store id) using a pool of
+    `processes` worker processes. At most `2 * processes` chunks per shard are in flight, which bounds the memory used
+    by loaded but not yet computed chunks. Shards are loaded in parallel, sharing the pool, and merged by store id
+    """
+    # forked workers must not share the parent's database connections
+    connections.close_all()
+
+    with billiard.Pool(processes=processes, initializer=_init_worker) as pool:
+        def compute_shard(using: 'str | None') -> 'Iterator[StoreReportDict]':
+            max_pending = 2 * processes
+            completed_stores = 0
+            pending = deque()
+            for chunk in iter_store_chunks(from_datetime, chunk_size, after_store_id, using=using):
+                pending.append(pool.apply_async(compute_store_chunk, (from_datetime, chunk, policy)))
+                if len(pending) >= max_pending:
+                    reports = pending.popleft().get()
+                    completed_stores += len(reports)
+                    logger.info(f'Completed {completed_stores} stores of {using or "default"}')
+                    yield from reports
+
+            while pending:
+                yield from pending.popleft().get()
+
+        yield from merge_shards(compute_shard, key=lambda report: report['store_id'])
@@ -1,5 +1,8 @@
 from rest_framework import serializers
 
+from .models import StoreReportRow, StoreUptimeAggregate
+from .utils import StoreReportDict
+
 
 class ReportIdSerializer(serializers.Serializer):
     report_id = serializers.UUIDField(read_only=True)
@@ -15,6 +18,62 @@ class ReportSerializer(serializers.Serializer):
     report_id = serializers.UUIDField(write_only=True)
     status = serializers.ChoiceField(choices=['failed', 'running', 'completed'], read_only=True)
     report = serializers.FileField(required=False, read_only=True)
+    download = serializers.URLField(required=False, read_only=True)
+
+    def update(self, instance, validated_data):
+        raise Exception('Not allowed')
+
+    def create(self, validated_data):
+        raise Exception('Not allowed')
+
+
+class ReportRowsQuerySerializer(serializers.Serializer):
+    report_id = serializers.UUIDField()
+    store_id = serializers.ListField(child=serializers.IntegerField(), required=False)
+    # keyset cursor, rows of stores after this store id
+    after = serializers.IntegerField(required=False)
+    limit = serializers.IntegerField(min_value=1, max_value=1000, default=100)
+
+    def update(self, instance, validated_data):
+        raise Exception('Not allowed')
+
+    def create(self, validated_data):
+        raise Exception('Not allowed')
+
+
+class StoreReportRowSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = StoreReportRow
+        fields = list(StoreReportDict.__annotations__)
+        read_only_fields = fields
+
+
+class UptimeHistoryQuerySerializer(serializers.Serializer):
+    start = serializers.DateField()
+    end = serializers.DateField()
+    store_id = serializers.ListField(child=serializers.IntegerField(), required=False)
+    timezone = serializers.CharField(required=False)
+    # coarsest tier covering the range by default
+    resolution = serializers.ChoiceField(choices=StoreUptimeAggregate.Resolution.choices, required=False)
+
+    def validate(self, attrs):
+        if attrs['start'] > attrs['end']:
+            raise serializers.ValidationError('start must not be after end')
+        return attrs
+
+    def update(self, instance, validated_data):
+        raise Exception('Not allowed')
+
+    def create(self, validated_data):
+        raise Exception('Not allowed')
+
+
+class UptimeHistoryPointSerializer(serializers.Serializer):
+    period_start = serializers.DateField(read_only=True)
+    stores = serializers.IntegerField(read_only=True)
+    uptime_hours = serializers.FloatField(read_only=True)
+    downtime_hours = serializers.FloatField(read_only=True)
+    unknown_hours = serializers.FloatField(read_only=True)
 
     def update(self, instance, validated_data):
         raise Exception('Not allowed')
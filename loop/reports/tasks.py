@@ -1,171 +1,221 @@
 import csv
 import io
 import logging
-from datetime import datetime, timedelta
-from typing import TypedDict
+from datetime import date, datetime, timedelta
+from typing import Iterator
 
 from celery import shared_task
-from django.core.files.base import ContentFile
-
-from reports.models import StoreReport
-from stores.models import Store, StoreStatus
-from stores.utils import StoreBusinessHourHelper
+from celery.exceptions import SoftTimeLimitExceeded
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from loop.db_routers import merge_shards, read_from_replica
+from reports.history import build_history, compute_day, prune_days
+from reports.interpolation import InterpolationPolicy, get_interpolation_policy
+from reports.models import StoreReport, StoreReportCheckpoint, StoreReportRow
+from reports.parallel import generate_store_reports_parallel
+from reports.utils import StoreReportDict, accumulate_uptime_downtime, build_store_report
+from stores.models import Store
+from stores.utils import StoreBusinessHourHelper, group_stores_by_timezone, prepare_timezone_offsets
 
 logger = logging.getLogger(__name__)
 
 
-class StoreReportDict(TypedDict):
-    store_id: int
-    uptime_last_hour: float
-    downtime_last_hour: float
-    uptime_last_day: float
-    downtime_last_day: float
-    uptime_last_week: float
-    downtime_last_week: float
-
-
-class StatusDict(TypedDict):
-    is_active: bool
-    timestamp_utc: datetime
+def calculate_uptime_downtime(
+        start_datetime: datetime,
+        end_datetime: datetime,
+        helper: 'StoreBusinessHourHelper',
+        policy: 'InterpolationPolicy | None' = None,
+) -> (timedelta, timedelta, timedelta):
+    """
+    Calculate uptime, downtime and unknown time from start_datetime to end_datetime, see `accumulate_uptime_downtime`
+    """
+    return accumulate_uptime_downtime(
+        query_status_list(start_datetime, end_datetime, helper),
+        helper.shifts_generator(start_datetime, end_datetime),
+        policy,
+    )
 
 
-def calculate_uptime_downtime(
+def query_status_list(
         start_datetime: datetime, end_datetime: datetime, helper: 'StoreBusinessHourHelper'
-) -> (timedelta, timedelta):
+) -> 'list[tuple[datetime, bool]]':
     """
-    Calculate uptime and downtime from start_datetime to end_datetime, if no status for business hours of that day, then
-    consider it as downtime
+    Statuses of the store from start_datetime to end_datetime, as `(timestamp_utc, is_active)` ordered by timestamp.
+    Not filtered by business hours, `accumulate_uptime_downtime` ignores the statuses outside the (UTC) shifts, the
+    same as the process pool path
     """
-    status_list: 'list[StatusDict]' = list(
-        StoreStatus.objects
-        .filter(store=helper.store, timestamp_utc__gte=start_datetime, timestamp_utc__lte=end_datetime)
-        .filter_store_hours(helper=helper)
+    # through the store, so the statuses are read from its shard
+    return list(
+        helper.store.status
+        .filter(timestamp_utc__gte=start_datetime, timestamp_utc__lte=end_datetime)
         .order_by('timestamp_utc')
-        .values('is_active', 'timestamp_utc')
+        .values_list('timestamp_utc', 'is_active')
     )
 
-    uptime = timedelta()
-    downtime = timedelta()
-
-    status_index = 0
 
-    # iterate through all business hours in the given time range
-    for shift in helper.shifts_generator(start_datetime, end_datetime):
-        # get all statuses of this business hour
-        statuses_of_this_business_hour: 'list[StatusDict]' = []
-        while status_index < len(status_list):
-            status = status_list[status_index]
-            if shift.start_datetime <= status['timestamp_utc'] <= shift.end_datetime:
-                statuses_of_this_business_hour.append(status)
-                status_index += 1
-            else:
-                break
-
-        if len(statuses_of_this_business_hour) == 0:
-            # no status found for this business hour
-            # consider it as downtime
-            downtime += shift.end_datetime - shift.start_datetime
-        else:
-            # handle first status
-            first_status = statuses_of_this_business_hour[0]
-            time_diff = first_status['timestamp_utc'] - shift.start_datetime
-            if first_status['is_active']:
-                # store is open, assume from business hour start time to first status is uptime
-                uptime += time_diff
-            else:
-                # store is closed, assume from business hour start time to first status is downtime
-                downtime += time_diff
-
-            last_status = first_status
-            # handle middle statuses
-            for status in statuses_of_this_business_hour[1:]:
-                time_diff = status['timestamp_utc'] - last_status['timestamp_utc']
-                if last_status['is_active'] and status['is_active']:
-                    # last status is up and current status is up, assume from last status to current status is uptime
-                    uptime += time_diff
-                elif not last_status['is_active'] and not status['is_active']:
-                    # last status is down and current status is down, assume from last status to current status is
-                    # downtime
-                    downtime += time_diff
-                elif last_status['is_active'] and not status['is_active']:
-                    # last status is up and current status is down, assume from last status to current status is
-                    # downtime
-                    downtime += time_diff
-                elif not last_status['is_active'] and status['is_active']:
-                    # last status is down and current status is up, assume from last status to current status is uptime
-                    uptime += time_diff
-                last_status = status
-
-            # handle last status
-            time_diff = shift.end_datetime - last_status['timestamp_utc']
-            if last_status['is_active']:
-                # store is open, assume from last status to end of business hour is uptime
-                uptime += time_diff
-            else:
-                # store is closed, assume from last status to end of business hour is downtime
-                downtime += time_diff
+def generate_store_reports(
+        from_datetime: datetime, policy: 'InterpolationPolicy | None' = None, after_store_id: 'int | None' = None
+) -> 'Iterator[StoreReportDict]':
+    """
+    Generate report rows of all stores (after `after_store_id` if given, ordered by store id) in this process, one
+    status query per store. Shards are scanned in parallel and merged by store id
+    """
 
-    return uptime, downtime
+    def generate_shard(using: 'str | None') -> 'Iterator[StoreReportDict]':
+        stores = Store.objects.using(using).order_by('store_id')
+        if after_store_id is not None:
+            stores = stores.filter(store_id__gt=after_store_id)
 
+        stores_by_timezone = group_stores_by_timezone(stores.values_list('store_id', 'timezone_str'))
+        prepare_timezone_offsets(
+            stores_by_timezone, (from_datetime - timedelta(weeks=1)).date(), from_datetime.date()
+        )
 
-@shared_task(name='reports.tasks.generate_report')
-def generate_report(from_datetime_str: str):
-    """
-    Generate report for each store, with uptime and downtime for last hour, last day, and last week
-    """
-    from_datetime: 'datetime' = datetime.fromisoformat(from_datetime_str)
+        total_stores = sum(len(store_ids) for store_ids in stores_by_timezone.values())
+        logger.info(
+            f'Generating report for {total_stores} stores of {using or "default"} '
+            f'across {len(stores_by_timezone)} timezones'
+        )
+        completed_stores = 0
 
-    reports: 'list[StoreReportDict]' = []
-    stores = Store.objects.all()
+        for store in stores:
+            if completed_stores % 100 == 0:
+                logger.info(f'Completed {completed_stores} out of {total_stores} stores')
 
-    total_stores = stores.count()
-    completed_stores = 0
+            business_hour_helper = StoreBusinessHourHelper(store=store)
+            # statuses of the last week, last hour and last day are sliced out of it
+            status_list = query_status_list(from_datetime - timedelta(weeks=1), from_datetime, business_hour_helper)
+            yield build_store_report(from_datetime, business_hour_helper, status_list, policy)
+            completed_stores += 1
 
-    for store in stores:
-        if completed_stores % 100 == 0:
-            logger.info(f'Completed {completed_stores} out of {total_stores} stores')
+    return merge_shards(generate_shard, key=lambda report: report['store_id'])
 
-        business_hour_helper = StoreBusinessHourHelper(store=store)
 
-        uptime_last_hour, downtime_last_hour = calculate_uptime_downtime(
-            start_datetime=from_datetime - timedelta(hours=1),
-            end_datetime=from_datetime,
-            helper=business_hour_helper,
-        )
-        uptime_last_day, downtime_last_day = calculate_uptime_downtime(
-            start_datetime=from_datetime - timedelta(days=1),
-            end_datetime=from_datetime,
-            helper=business_hour_helper,
+def save_checkpoint(report_id: str, reports: 'list[StoreReportDict]'):
+    """
+    Save the rows of a batch of stores and move the report cursor past them, atomically
+    """
+    with transaction.atomic():
+        StoreReportRow.objects.bulk_create(
+            [StoreReportRow(report_id=report_id, **report) for report in reports],
+            # rows saved by an attempt which was killed before updating the cursor
+            ignore_conflicts=True,
         )
-        uptime_last_week, downtime_last_week = calculate_uptime_downtime(
-            start_datetime=from_datetime - timedelta(weeks=1),
-            end_datetime=from_datetime,
-            helper=business_hour_helper,
+        StoreReportCheckpoint.objects.update_or_create(
+            report_id=report_id, defaults={'last_store_id': reports[-1]['store_id']},
         )
 
-        reports.append({
-            'store_id': store.store_id,
-            'uptime_last_hour': uptime_last_hour.total_seconds() / 60,
-            'downtime_last_hour': downtime_last_hour.total_seconds() / 60,
-            'uptime_last_day': uptime_last_day.total_seconds() / 3600,
-            'downtime_last_day': downtime_last_day.total_seconds() / 3600,
-            'uptime_last_week': uptime_last_week.total_seconds() / 3600,
-            'downtime_last_week': downtime_last_week.total_seconds() / 3600,
-        })
-        completed_stores += 1
-
-    logger.info(f'Generated report for {len(reports)} stores')
 
+def write_report_content(report_id: str) -> bytes:
+    """
+    CSV content of the saved rows of a report, ordered by store id
+    """
     file_io = io.StringIO()
-    writer = csv.DictWriter(file_io, fieldnames=reports[0].keys())
+    writer = csv.DictWriter(file_io, fieldnames=StoreReportDict.__annotations__.keys())
     writer.writeheader()
-    # noinspection PyTypeChecker
-    writer.writerows(reports)
-    report_file = ContentFile(file_io.getvalue().encode(), name=f'{generate_report.request.id}.csv')
-    StoreReport.objects.create(
-        # task id of celery task
-        report_id=generate_report.request.id,
-        file=report_file,
+    writer.writerows(
+        StoreReportRow.objects.filter(report_id=report_id).order_by('store_id')
+        .values(*StoreReportDict.__annotations__.keys()).iterator()
     )
+    return file_io.getvalue().encode()
+
+
+@shared_task(
+    bind=True,
+    name='reports.tasks.generate_report',
+    # redeliver the task if the worker process is lost (killed, restarted), it resumes from its checkpoint. A task
+    # reaching the hard time limit is failed and acknowledged (`acks_on_failure_or_timeout`), only the soft time limit
+    # keeps it resumable
+    acks_late=True,
+    reject_on_worker_lost=True,
+    max_retries=settings.REPORT_MAX_RETRIES,
+)
+def generate_report(self, from_datetime_str: str):
+    """
+    Generate report for each store, with uptime and downtime for last hour, last day, and last week.
+
+    Rows are saved every `REPORT_CHECKPOINT_INTERVAL` stores along with the last completed store id. A retry (on soft
+    time limit) or a redelivery (worker lost) of the same report id resumes after the last checkpoint
+    """
+    report_id = self.request.id
+    from_datetime: 'datetime' = datetime.fromisoformat(from_datetime_str)
+
+    policy = get_interpolation_policy(
+        settings.REPORT_INTERPOLATION_POLICY, settings.REPORT_INTERPOLATION_MAX_GAP_MINUTES
+    )
+
+    checkpoint = StoreReportCheckpoint.objects.filter(report_id=report_id).first()
+    after_store_id = checkpoint.last_store_id if checkpoint else None
+    if after_store_id is not None:
+        logger.info(f'Resuming report {report_id} after store {after_store_id}')
+
+    pending: 'list[StoreReportDict]' = []
+
+    def flush():
+        if pending:
+            save_checkpoint(report_id, pending)
+            pending.clear()
+
+    processes = settings.REPORT_PROCESSES
+    try:
+        with read_from_replica():
+            if processes > 1:
+                store_reports = generate_store_reports_parallel(
+                    from_datetime, processes, settings.REPORT_CHUNK_SIZE, policy, after_store_id
+                )
+            else:
+                store_reports = generate_store_reports(from_datetime, policy, after_store_id)
+            for report in store_reports:
+                pending.append(report)
+                if len(pending) >= settings.REPORT_CHECKPOINT_INTERVAL:
+                    flush()
+        flush()
+
+        with transaction.atomic():
+            # task id of celery task
+            store_report = StoreReport(report_id=report_id)
+            store_report.set_content(write_report_content(report_id))
+            store_report.save(force_insert=True)
+            # rows are kept, they serve `get_report_rows/`
+            StoreReportCheckpoint.objects.filter(report_id=report_id).delete()
+    except SoftTimeLimitExceeded:
+        # stop cleanly before the hard time limit, keep the progress and continue in a new attempt, which only writes
+        # the report if every row was saved already
+        flush()
+        logger.info(f'Report {report_id} reached the soft time limit, retrying from its checkpoint')
+        raise self.retry(countdown=0)
+
+    logger.info(f'Generated report {report_id}')
 
     return None
+
+
+@shared_task(name='reports.tasks.compact_uptime_history')
+def compact_uptime_history(day_str: 'str | None' = None):
+    """
+    Scheduled daily (`CELERY_BEAT_SCHEDULE`): compute the day tier of the uptime history for the given UTC day
+    (yesterday by default), compact its month once the day closes it and drop the days past their retention
+    """
+    day = date.fromisoformat(day_str) if day_str else timezone.now().date() - timedelta(days=1)
+    policy = get_interpolation_policy(
+        settings.REPORT_INTERPOLATION_POLICY, settings.REPORT_INTERPOLATION_MAX_GAP_MINUTES
+    )
+    months = build_history(day, day, settings.REPORT_CHUNK_SIZE, policy)
+    deleted = prune_days(day - timedelta(days=settings.REPORT_HISTORY_DAY_RETENTION_DAYS))
+    logger.info(f'Compacted uptime history of {day}, months {months}, {deleted} expired days deleted')
+
+
+@shared_task(name='reports.tasks.refresh_uptime_history')
+def refresh_uptime_history():
+    """
+    Scheduled every `REPORT_HISTORY_REFRESH_MINUTES` (`CELERY_BEAT_SCHEDULE`): compute the day tier of the current UTC
+    day until now, the uptime history serves the open day from it rather than from the raw statuses
+    """
+    now = timezone.now()
+    policy = get_interpolation_policy(
+        settings.REPORT_INTERPOLATION_POLICY, settings.REPORT_INTERPOLATION_MAX_GAP_MINUTES
+    )
+    stores = compute_day(now.date(), settings.REPORT_CHUNK_SIZE, policy, until=now)
+    logger.info(f'Refreshed uptime history of {now.date()} until {now} for {stores} stores')
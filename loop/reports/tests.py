@@ -0,0 +1,459 @@
+import csv
+import gzip
+import hashlib
+import io
+import os
+import tempfile
+import uuid
+from datetime import date, time, timedelta
+from unittest import mock, skipUnless
+
+from celery.exceptions import SoftTimeLimitExceeded
+from django.conf import settings
+from django.core.management import call_command
+from django.core.files.base import ContentFile
+from django.db import router
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from loop.db_routers import get_store_shard, read_from_replica
+from stores.archive import export_week
+from stores.models import Store, StoreBusinessHour, StoreStatus
+from stores.tests import set_status_timestamps
+from stores.utils import StoreBusinessHourHelper
+from .history import DAY, MONTH, build_history, get_history, prune_days
+from .interpolation import CarryForwardPolicy, MidpointPolicy
+from .management.commands.loadtest_api import percentile
+from .models import StoreReport, StoreReportCheckpoint, StoreReportRow, StoreUptimeAggregate
+from .parallel import generate_store_reports_parallel
+from .tasks import (
+    generate_report, generate_store_reports, refresh_uptime_history, save_checkpoint, write_report_content,
+)
+from .utils import accumulate_uptime_downtime, build_store_report
+
+
+class ReportStoresMixin:
+    def setUp(self) -> None:
+        self.from_datetime = timezone.datetime(2023, 1, 25, 12, 0, 0, tzinfo=timezone.utc)
+
+        # always open
+        Store.objects.create(**{'store_id': 1, 'timezone_str': 'UTC'})
+        # open in the morning only
+        Store.objects.create(**{'store_id': 2, 'timezone_str': 'UTC'})
+        for day in range(7):
+            StoreBusinessHour.objects.create(**{
+                'store_id': 2,
+                'day': day,
+                'start_time_local': '08:00:00',
+                'end_time_local': '11:00:00',
+            })
+        # no status at all
+        Store.objects.create(**{'store_id': 3, 'timezone_str': 'Asia/Kolkata'})
+
+        statuses = []
+        for hours_ago in range(0, 24 * 7, 3):
+            for store_id in (1, 2):
+                statuses.append(StoreStatus(store_id=store_id, is_active=hours_ago % 2 == 0))
+        StoreStatus.objects.bulk_create(statuses)
+        set_status_timestamps(
+            StoreStatus.objects.all(), lambda i: self.from_datetime - timedelta(hours=3 * (i // 2), minutes=17)
+        )
+
+
+class TestUptimeDowntime(ReportStoresMixin, TestCase):
+    def test_accumulate_uptime_downtime(self):
+        helper = StoreBusinessHourHelper(Store.objects.get(store_id=2))
+        start_datetime = timezone.datetime(2023, 1, 24, 0, 0, 0, tzinfo=timezone.utc)
+        end_datetime = timezone.datetime(2023, 1, 24, 23, 0, 0, tzinfo=timezone.utc)
+        status_list = [
+            # outside business hours, ignored
+            (timezone.datetime(2023, 1, 24, 7, 0, 0, tzinfo=timezone.utc), False),
+            (timezone.datetime(2023, 1, 24, 9, 0, 0, tzinfo=timezone.utc), True),
+            (timezone.datetime(2023, 1, 24, 10, 0, 0, tzinfo=timezone.utc), False),
+        ]
+        shifts = list(helper.shifts_generator(start_datetime, end_datetime))
+
+        # 08:00 - 09:00 up (first status), 09:00 - 11:00 down (counted by the status closing each interval)
+        self.assertEqual(
+            accumulate_uptime_downtime(status_list, shifts),
+            (timedelta(hours=1), timedelta(hours=2), timedelta()),
+        )
+        # 09:00 - 09:30 up, 10:00 - 10:30 down, rest unknown
+        self.assertEqual(
+            accumulate_uptime_downtime(status_list, shifts, CarryForwardPolicy(timedelta(minutes=30))),
+            (timedelta(minutes=30), timedelta(minutes=30), timedelta(hours=2)),
+        )
+        # 08:00 - 09:30 up, 09:30 - 11:00 down
+        self.assertEqual(
+            accumulate_uptime_downtime(status_list, shifts, MidpointPolicy()),
+            (timedelta(hours=1, minutes=30), timedelta(hours=1, minutes=30), timedelta()),
+        )
+        # shift without status
+        self.assertEqual(
+            accumulate_uptime_downtime([], shifts, MidpointPolicy()),
+            (timedelta(), timedelta(), timedelta(hours=3)),
+        )
+
+    def test_report_windows_are_clipped(self):
+        # always open, shifts are whole UTC days
+        helper = StoreBusinessHourHelper(Store(store_id=1, timezone_str='UTC'), [])
+        status_list = [(self.from_datetime - timedelta(minutes=30), True)]
+        for policy in (None, CarryForwardPolicy(timedelta(minutes=60))):
+            report = build_store_report(self.from_datetime, helper, status_list, policy)
+            for window, length in (('last_hour', 60), ('last_day', 24), ('last_week', 24 * 7)):
+                total = sum(report[f'{bucket}_{window}'] for bucket in ('uptime', 'downtime', 'unknown'))
+                self.assertLessEqual(total, length + 1e-6)
+            self.assertAlmostEqual(report['uptime_last_hour'], 60 if policy is None else 30)
+
+    def test_generate_report_resumes_from_checkpoint(self):
+        report_id = str(uuid.uuid4())
+        # store 1 was completed by an interrupted attempt
+        saved_row = {
+            'store_id': 1, 'uptime_last_hour': 1, 'downtime_last_hour': 2, 'uptime_last_day': 3,
+            'downtime_last_day': 4, 'uptime_last_week': 5, 'downtime_last_week': 6, 'unknown_last_hour': 0,
+            'unknown_last_day': 0, 'unknown_last_week': 0,
+        }
+        save_checkpoint(report_id, [saved_row])
+
+        # in process, the process pool closes the connections and with them the transaction of the test
+        with self.settings(REPORT_PROCESSES=1, REPORT_CHECKPOINT_INTERVAL=1):
+            generate_report.apply(args=(self.from_datetime.isoformat(),), task_id=report_id)
+
+        report = StoreReport.objects.get(report_id=report_id)
+        with report.file.open('r') as f:
+            rows = list(csv.DictReader(f))
+        report.file.delete(save=False)
+        report.gzip_file.delete(save=False)
+        self.assertEqual([int(row['store_id']) for row in rows], [1, 2, 3])
+        self.assertEqual(float(rows[0]['uptime_last_week']), 5)
+        self.assertEqual(StoreReportRow.objects.filter(report_id=report_id).count(), 3)
+        self.assertFalse(StoreReportCheckpoint.objects.filter(report_id=report_id).exists())
+
+        # rows are kept for lookups
+        response = self.client.get(reverse('get_report_rows'), {'report_id': report_id, 'limit': 2})
+        self.assertEqual([row['store_id'] for row in response.data['results']], [1, 2])
+        response = self.client.get(response.data['next'])
+        self.assertEqual([row['store_id'] for row in response.data['results']], [3])
+        self.assertIsNone(response.data['next'])
+
+        response = self.client.get(reverse('get_report_rows'), {'report_id': report_id, 'store_id': [1, 3]})
+        self.assertEqual([row['store_id'] for row in response.data['results']], [1, 3])
+        self.assertEqual(response.data['results'][0]['uptime_last_week'], 5)
+
+
+    def test_generate_report_retries_soft_time_limit_while_writing(self):
+        report_id = str(uuid.uuid4())
+        attempts = []
+
+        def interrupted_write_report_content(report_id: str) -> bytes:
+            attempts.append(report_id)
+            if len(attempts) == 1:
+                raise SoftTimeLimitExceeded()
+            return write_report_content(report_id)
+
+        with self.settings(REPORT_PROCESSES=1), \
+                mock.patch('reports.tasks.write_report_content', side_effect=interrupted_write_report_content):
+            generate_report.apply(args=(self.from_datetime.isoformat(),), task_id=report_id)
+
+        # the retry found every row in the checkpoint and only wrote the report
+        self.assertEqual(len(attempts), 2)
+        report = StoreReport.objects.get(report_id=report_id)
+        with report.file.open('r') as f:
+            self.assertEqual([int(row['store_id']) for row in csv.DictReader(f)], [1, 2, 3])
+        report.file.delete(save=False)
+        report.gzip_file.delete(save=False)
+
+class TestParallelReports(ReportStoresMixin, TransactionTestCase):
+    # the process pool closes the connections, it can not run within the transaction of a `TestCase`
+
+    def test_parallel_matches_in_process(self):
+        # open 09:00 - 12:00 local (03:30 - 06:30 UTC), polled every hour
+        Store.objects.create(**{'store_id': 4, 'timezone_str': 'Asia/Kolkata'})
+        for day in range(7):
+            StoreBusinessHour.objects.create(store_id=4, day=day, start_time_local=time(9), end_time_local=time(12))
+        StoreStatus.objects.bulk_create([StoreStatus(store_id=4, is_active=i % 3 != 0) for i in range(24 * 7)])
+        set_status_timestamps(
+            StoreStatus.objects.filter(store_id=4), lambda i: self.from_datetime - timedelta(hours=i, minutes=17)
+        )
+
+        policy = CarryForwardPolicy(timedelta(hours=2))
+        in_process = list(generate_store_reports(self.from_datetime, policy))
+        parallel = list(generate_store_reports_parallel(self.from_datetime, processes=2, chunk_size=1, policy=policy))
+        self.assertEqual([report['store_id'] for report in parallel], [1, 2, 3, 4])
+        self.assertEqual(in_process, parallel)
+        # no status at all, whole week is unknown
+        self.assertEqual(parallel[2]['uptime_last_week'], 0)
+        self.assertEqual(parallel[2]['downtime_last_week'], 0)
+        self.assertGreater(parallel[2]['unknown_last_week'], 0)
+        # statuses within the local business hours are counted, 21 hours a week
+        self.assertGreater(parallel[3]['uptime_last_week'], 0)
+        self.assertAlmostEqual(
+            parallel[3]['uptime_last_week'] + parallel[3]['downtime_last_week'] + parallel[3]['unknown_last_week'], 21
+        )
+
+
+class TestUptimeHistory(TestCase):
+    def setUp(self) -> None:
+        # always open, always active
+        Store.objects.create(**{'store_id': 1, 'timezone_str': 'UTC'})
+        # open overnight, always inactive
+        Store.objects.create(**{'store_id': 2, 'timezone_str': 'UTC'})
+        for day in range(7):
+            StoreBusinessHour.objects.create(
+                store_id=2, day=day, start_time_local=time(22), end_time_local=time(23, 59, 59, 999999)
+            )
+            StoreBusinessHour.objects.create(store_id=2, day=day, start_time_local=time(0), end_time_local=time(2))
+
+        start_datetime = timezone.datetime(2023, 1, 30, 1, tzinfo=timezone.utc)
+        StoreStatus.objects.bulk_create([
+            StoreStatus(store_id=store_id, is_active=store_id == 1) for _ in range(8) for store_id in (1, 2)
+        ])
+        set_status_timestamps(StoreStatus.objects.all(), lambda i: start_datetime + timedelta(hours=6 * (i // 2)))
+
+    def test_build_and_query(self):
+        self.assertEqual(build_history(date(2023, 1, 30), date(2023, 1, 31), chunk_size=1), [date(2023, 1, 1)])
+        self.assertEqual(StoreUptimeAggregate.objects.filter(resolution=DAY).count(), 4)
+        day = StoreUptimeAggregate.objects.get(resolution=DAY, store_id=2, period_start=date(2023, 1, 30))
+        # 00:00 - 02:00 and 22:00 - 24:00 of the UTC day, not the business hours of the previous day twice
+        self.assertAlmostEqual(day.downtime_seconds, 4 * 3600, places=3)
+        self.assertEqual(day.uptime_seconds, 0)
+        month = StoreUptimeAggregate.objects.get(resolution=MONTH, store_id=1)
+        self.assertEqual(month.period_start, date(2023, 1, 1))
+        self.assertAlmostEqual(month.uptime_seconds, 2 * 24 * 3600, places=3)
+
+        today = date(2023, 2, 1)
+        resolution, points = get_history(date(2023, 1, 1), date(2023, 1, 31), today)
+        self.assertEqual((resolution, len(points), points[0]['stores']), (MONTH, 1, 2))
+        self.assertAlmostEqual(points[0]['uptime_hours'], 48)
+        resolution, points = get_history(date(2023, 1, 31), date(2023, 1, 31), today, store_ids=[2])
+        self.assertEqual((resolution, len(points), points[0]['uptime_hours']), (DAY, 1, 0))
+        # days past their retention are served by their months, clipped to the range
+        resolution, points = get_history(date(2023, 1, 31), date(2023, 1, 31), date(2024, 6, 1))
+        self.assertEqual((resolution, [point['period_start'] for point in points]), (MONTH, [date(2023, 1, 1)]))
+        self.assertAlmostEqual(points[0]['uptime_hours'], 24)
+
+        response = self.client.get(
+            reverse('get_uptime_history'),
+            {'start': '2023-01-30', 'end': '2023-01-31', 'timezone': 'UTC', 'resolution': 'day'},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['resolution'], DAY)
+        self.assertEqual([point['stores'] for point in response.json()['results']], [2, 2])
+
+        self.assertEqual(prune_days(date(2023, 1, 31)), 2)
+        self.assertEqual(StoreUptimeAggregate.objects.filter(resolution=DAY).count(), 2)
+
+    def test_build_from_archive(self):
+        with tempfile.TemporaryDirectory() as root, self.settings(STATUS_ARCHIVE_ROOT=root):
+            export_week(root, timezone.datetime(2023, 1, 30, tzinfo=timezone.utc))
+            # recomputed from the archive alone
+            StoreStatus.objects.all().delete()
+            build_history(date(2023, 1, 30), date(2023, 1, 31), chunk_size=1)
+
+        day = StoreUptimeAggregate.objects.get(resolution=DAY, store_id=2, period_start=date(2023, 1, 30))
+        self.assertAlmostEqual(day.downtime_seconds, 4 * 3600, places=3)
+        month = StoreUptimeAggregate.objects.get(resolution=MONTH, store_id=1)
+        self.assertAlmostEqual(month.uptime_seconds, 2 * 24 * 3600, places=3)
+
+    def test_query_current_month(self):
+        build_history(date(2023, 1, 30), date(2023, 1, 31), chunk_size=1)
+        status = StoreStatus.objects.create(store_id=1, is_active=True)
+        set_status_timestamps(
+            StoreStatus.objects.filter(pk=status.pk), lambda i: timezone.datetime(2023, 2, 1, 6, tzinfo=timezone.utc)
+        )
+        today = date(2023, 2, 1)
+        # not refreshed yet, no point rather than reading the raw statuses
+        resolution, points = get_history(date(2023, 1, 1), date(2023, 2, 28), today)
+        self.assertEqual([point['period_start'] for point in points], [date(2023, 1, 1)])
+
+        noon = timezone.datetime(2023, 2, 1, 12, tzinfo=timezone.utc)
+        with mock.patch('django.utils.timezone.now', return_value=noon):
+            refresh_uptime_history.apply()
+
+        # the compacted january from its month, the open february from its day refreshed until noon
+        resolution, points = get_history(date(2023, 1, 1), date(2023, 2, 28), today)
+        self.assertEqual(resolution, MONTH)
+        self.assertEqual([point['period_start'] for point in points], [date(2023, 1, 1), date(2023, 2, 1)])
+        self.assertAlmostEqual(points[0]['uptime_hours'], 48)
+        february = points[1]
+        self.assertEqual(february['stores'], 2)
+        self.assertGreater(february['uptime_hours'], 0)
+        # 12 hours of store 1 and 2 hours of store 2 so far
+        self.assertAlmostEqual(
+            february['uptime_hours'] + february['downtime_hours'] + february['unknown_hours'], 14, places=3
+        )
+
+        resolution, points = get_history(date(2023, 1, 31), date(2023, 2, 1), today, store_ids=[2])
+        self.assertEqual(resolution, DAY)
+        self.assertEqual([point['period_start'] for point in points], [date(2023, 1, 31), date(2023, 2, 1)])
+        self.assertAlmostEqual(points[1]['downtime_hours'] + points[1]['unknown_hours'], 2, places=3)
+
+
+@skipUnless(
+    len(settings.STORE_SHARDS) > 1,
+    'needs store shards: `LOADTEST_SHARDS=2 python manage.py test reports.tests.TestStoreSharding '
+    '--settings=loop.settings_loadtest`',
+)
+class TestStoreSharding(TransactionTestCase):
+    databases = '__all__'
+
+    from_datetime = timezone.datetime(2023, 1, 25, 12, 0, 0, tzinfo=timezone.utc)
+    store_ids = list(range(1, 9))
+
+    def setUp(self) -> None:
+        from_datetime, store_ids = self.from_datetime, self.store_ids
+        with tempfile.TemporaryDirectory() as directory:
+            with open(os.path.join(directory, 'store-timezone.csv'), 'w') as f:
+                f.write('store_id,timezone_str\n')
+                f.writelines(f'{store_id},UTC\n' for store_id in store_ids)
+            with open(os.path.join(directory, 'store-status.csv'), 'w') as f:
+                f.write('store_id,status,timestamp_utc\n')
+                # always open stores, even stores always active, odd stores always inactive
+                for _ in range(28):
+                    f.writelines(
+                        f'{store_id},{"active" if store_id % 2 == 0 else "inactive"},{from_datetime.isoformat()}\n'
+                        for store_id in store_ids
+                    )
+            call_command(
+                'import_all', directory=directory, processes=1, loaders=1, chunk_size=5, stdout=io.StringIO()
+            )
+        # every 6 hours over the last week
+        for store_id in store_ids:
+            set_status_timestamps(
+                StoreStatus.objects.using(get_store_shard(store_id)).filter(store_id=store_id),
+                lambda i: from_datetime - timedelta(hours=6 * i, minutes=1),
+            )
+
+    def test_sharded_import(self):
+        store_ids = self.store_ids
+        shard_store_ids = {
+            shard: set(Store.objects.using(shard).values_list('store_id', flat=True))
+            for shard in settings.STORE_SHARDS
+        }
+        # every store on its shard only, statuses along with it
+        self.assertEqual(sorted(store_id for ids in shard_store_ids.values() for store_id in ids), store_ids)
+        self.assertTrue(all(shard_store_ids.values()))
+        for store_id in store_ids:
+            self.assertIn(store_id, shard_store_ids[get_store_shard(store_id)])
+            store = Store.objects.using(get_store_shard(store_id)).get(store_id=store_id)
+            self.assertEqual(store.status.count(), 28)
+
+    def assertShardedReport(self, processes: int):
+        # shards scanned in parallel, merged by store id, resumed across checkpoints
+        report_id = str(uuid.uuid4())
+        with self.settings(REPORT_PROCESSES=processes, REPORT_CHUNK_SIZE=2, REPORT_CHECKPOINT_INTERVAL=3):
+            generate_report.apply(args=(self.from_datetime.isoformat(),), task_id=report_id)
+
+        report = StoreReport.objects.get(report_id=report_id)
+        with report.file.open('r') as f:
+            rows = list(csv.DictReader(f))
+        report.file.delete(save=False)
+        report.gzip_file.delete(save=False)
+        self.assertEqual([int(row['store_id']) for row in rows], self.store_ids)
+        for row in rows:
+            uptime, downtime = float(row['uptime_last_week']), float(row['downtime_last_week'])
+            # the whole week window, shifts are clipped to it
+            self.assertAlmostEqual(uptime if int(row['store_id']) % 2 == 0 else downtime, 24 * 7, places=6)
+            self.assertEqual(downtime if int(row['store_id']) % 2 == 0 else uptime, 0)
+
+    def test_sharded_report(self):
+        self.assertShardedReport(processes=2)
+
+    def test_sharded_report_in_process(self):
+        # `generate_store_reports`, one thread per shard
+        self.assertShardedReport(processes=1)
+
+
+class TestReplicaRouter(TestCase):
+    def test_read_from_replica(self):
+        with self.settings(DATABASE_REPLICA_ALIAS='replica'):
+            self.assertEqual(Store.objects.all().db, 'default')
+            with read_from_replica():
+                self.assertEqual(Store.objects.all().db, 'replica')
+                # writes always go to the primary
+                self.assertEqual(router.db_for_write(Store), 'default')
+
+
+class TestReportDownload(TestCase):
+    def setUp(self) -> None:
+        self.content = b'store_id,uptime_last_hour\n' + b''.join(f'{i},{i % 60}\n'.encode() for i in range(1000))
+        self.report = StoreReport(report_id=uuid.uuid4())
+        self.report.set_content(self.content)
+        self.report.save(force_insert=True)
+        self.url = reverse('download_report', args=[self.report.report_id])
+
+    def tearDown(self) -> None:
+        self.report.file.delete(save=False)
+        self.report.gzip_file.delete(save=False)
+
+    def test_download(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        etag = response['ETag']
+        self.assertEqual(etag, f'"{hashlib.sha256(self.content).hexdigest()}"')
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_content_disposition(self):
+        disposition = f'attachment; filename="{self.report.report_id}.csv"'
+        self.assertEqual(self.client.get(self.url)['Content-Disposition'], disposition)
+        self.assertEqual(self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip')['Content-Disposition'], disposition)
+        response = self.client.get(self.url, HTTP_RANGE='bytes=100-')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Disposition'], disposition)
+
+    def test_gzip(self):
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), self.content)
+        self.assertNotEqual(response['ETag'], self.client.get(self.url)['ETag'])
+
+    def test_prepare_download(self):
+        # report generated before the download artifacts, prepared once by the first of two downloads
+        report = StoreReport(report_id=uuid.uuid4(), file=ContentFile(self.content, name='legacy.csv'))
+        report.save(force_insert=True)
+        first, second = StoreReport.objects.get(pk=report.pk), StoreReport.objects.get(pk=report.pk)
+        first.prepare_download()
+        second.prepare_download()
+        self.assertEqual(second.gzip_file.name, first.gzip_file.name)
+        self.assertEqual(second.content_hash, hashlib.sha256(self.content).hexdigest())
+        with second.gzip_file.open('rb') as f:
+            self.assertEqual(gzip.decompress(f.read()), self.content)
+        report.file.delete(save=False)
+        first.gzip_file.delete(save=False)
+
+    def test_range(self):
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.get(self.url, HTTP_RANGE='bytes=100-', HTTP_IF_RANGE=etag)
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 100-{len(self.content) - 1}/{len(self.content)}')
+        self.assertEqual(b''.join(response.streaming_content), self.content[100:])
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-10')
+        self.assertEqual(b''.join(response.streaming_content), self.content[-10:])
+
+        # changed content, whole file
+        response = self.client.get(self.url, HTTP_RANGE='bytes=100-', HTTP_IF_RANGE='"other"')
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.get(self.url, HTTP_RANGE=f'bytes={len(self.content)}-')
+        self.assertEqual(response.status_code, 416)
+
+
+class TestLoadTest(TransactionTestCase):
+    def test_percentile(self):
+        latencies = list(range(1, 101))
+        self.assertEqual(percentile(latencies, 50), 50)
+        self.assertEqual(percentile(latencies, 99), 99)
+        self.assertEqual(percentile([], 99), 0)
+
+    def test_loadtest_api(self):
+        stdout = io.StringIO()
+        # triggers need a broker, completed reports are served from the database only
+        with self.settings(ALLOWED_HOSTS=['127.0.0.1']):
+            call_command('loadtest_api', pollers=2, triggers=0, duration=0.5, completed=2, stdout=stdout)
+        self.assertIn('Load test passed', stdout.getvalue())
+        self.assertFalse(StoreReport.objects.exists())
@@ -5,4 +5,7 @@ from . import views
 urlpatterns = [
     path('trigger/', views.ReportTriggerView.as_view(), name='trigger'),
     path('get_report/', views.ReportView.as_view(), name='get_report'),
+    path('get_report_rows/', views.ReportRowsView.as_view(), name='get_report_rows'),
+    path('get_uptime_history/', views.UptimeHistoryView.as_view(), name='get_uptime_history'),
+    path('download/<uuid:report_id>/', views.ReportDownloadView.as_view(), name='download_report'),
 ]
@@ -0,0 +1,119 @@
+from bisect import bisect_left
+from datetime import datetime, timedelta
+from typing import Iterable, Iterator, TypedDict
+
+from stores.utils import StoreBusinessHourHelper
+from .interpolation import ClosingStatusPolicy, InterpolationPolicy
+
+
+class StoreReportDict(TypedDict):
+    store_id: int
+    uptime_last_hour: float
+    downtime_last_hour: float
+    uptime_last_day: float
+    downtime_last_day: float
+    uptime_last_week: float
+    downtime_last_week: float
+    # time without usable status, always 0 with `ClosingStatusPolicy`
+    unknown_last_hour: float
+    unknown_last_day: float
+    unknown_last_week: float
+
+
+def clip_shifts(
+        shifts: 'Iterable[StoreBusinessHourHelper.StoreShift]', start_datetime: datetime, end_datetime: datetime
+) -> 'Iterator[StoreBusinessHourHelper.StoreShift]':
+    """
+    Parts of the shifts from start_datetime to end_datetime, whole shifts overlapping a report window or a history day
+    are not counted beyond it
+    """
+    for shift in shifts:
+        start = max(shift.start_datetime, start_datetime)
+        end = min(shift.end_datetime, end_datetime)
+        if start < end:
+            yield StoreBusinessHourHelper.StoreShift(start, end)
+
+
+def accumulate_uptime_downtime(
+        status_list: 'list[tuple[datetime, bool]]',
+        shifts: 'Iterable[StoreBusinessHourHelper.StoreShift]',
+        policy: 'InterpolationPolicy | None' = None,
+) -> (timedelta, timedelta, timedelta):
+    """
+    Accumulate uptime, downtime and unknown time over the given shifts from `(timestamp_utc, is_active)` statuses
+    ordered by timestamp, in a single pass. The time between statuses is attributed by the interpolation `policy`
+    (`ClosingStatusPolicy` by default, which never reports unknown). Statuses outside every shift are ignored.
+    Pure python, so it can run without database access (e.g. in worker processes)
+    """
+    policy = policy or ClosingStatusPolicy()
+    uptime = timedelta()
+    downtime = timedelta()
+    unknown = timedelta()
+
+    status_index = 0
+    status_count = len(status_list)
+
+    # iterate through all business hours in the given time range
+    for shift in shifts:
+        # skip statuses before this business hour (outside business hours)
+        while status_index < status_count and status_list[status_index][0] < shift.start_datetime:
+            status_index += 1
+
+        # segments from shift start to each status of this business hour, `None` at the shift start
+        last_timestamp, last_is_active = shift.start_datetime, None
+        while status_index < status_count and status_list[status_index][0] <= shift.end_datetime:
+            timestamp, is_active = status_list[status_index]
+            segment_uptime, segment_downtime, segment_unknown = policy.attribute(
+                timestamp - last_timestamp, last_is_active, is_active
+            )
+            uptime += segment_uptime
+            downtime += segment_downtime
+            unknown += segment_unknown
+            last_timestamp, last_is_active = timestamp, is_active
+            status_index += 1
+
+        # segment from last status (or shift start if no status) to the end of business hour
+        segment_uptime, segment_downtime, segment_unknown = policy.attribute(
+            shift.end_datetime - last_timestamp, last_is_active, None
+        )
+        uptime += segment_uptime
+        downtime += segment_downtime
+        unknown += segment_unknown
+
+    return uptime, downtime, unknown
+
+
+def build_store_report(
+        from_datetime: datetime,
+        helper: 'StoreBusinessHourHelper',
+        status_list: 'list[tuple[datetime, bool]]',
+        policy: 'InterpolationPolicy | None' = None,
+) -> StoreReportDict:
+    """
+    Build the report row of a store from its statuses of the last week (ordered by timestamp), the statuses of the last
+    hour and last day are sliced out of it rather than queried again
+    """
+    timestamps = [status[0] for status in status_list]
+
+    def window(start_datetime: datetime) -> (timedelta, timedelta, timedelta):
+        statuses = status_list[bisect_left(timestamps, start_datetime):]
+        # only the parts of the shifts within the window
+        shifts = clip_shifts(helper.shifts_generator(start_datetime, from_datetime), start_datetime, from_datetime)
+        return accumulate_uptime_downtime(statuses, shifts, policy)
+
+    uptime_last_hour, downtime_last_hour, unknown_last_hour = window(from_datetime - timedelta(hours=1))
+    uptime_last_day, downtime_last_day, unknown_last_day = window(from_datetime - timedelta(days=1))
+    uptime_last_week, downtime_last_week, unknown_last_week = window(from_datetime - timedelta(weeks=1))
+
+    return {
+        'store_id': helper.store.store_id,
+        'uptime_last_hour': uptime_last_hour.total_seconds() / 60,
+        'downtime_last_hour': downtime_last_hour.total_seconds() / 60,
+        'uptime_last_day': uptime_last_day.total_seconds() / 3600,
+        'downtime_last_day': downtime_last_day.total_seconds() / 3600,
+        'uptime_last_week': uptime_last_week.total_seconds() / 3600,
+        'downtime_last_week': downtime_last_week.total_seconds() / 3600,
+        'unknown_last_hour': unknown_last_hour.total_seconds() / 60,
+        'unknown_last_day': unknown_last_day.total_seconds() / 3600,
+        'unknown_last_week': unknown_last_week.total_seconds() / 3600,
+    }
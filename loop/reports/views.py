@@ -1,13 +1,24 @@
+import re
 from uuid import UUID
 
 from celery.result import AsyncResult
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
 from django.utils import timezone
+from django.views import View
 from rest_framework import generics
 from rest_framework.request import Request
 from rest_framework.response import Response
 
-from .models import StoreReport
-from .serializers import ReportSerializer, ReportIdSerializer
+from loop.db_routers import read_from_replica
+
+from .history import get_history
+from .models import StoreReport, StoreReportRow
+from .serializers import (
+    ReportIdSerializer, ReportRowsQuerySerializer, ReportSerializer, StoreReportRowSerializer,
+    UptimeHistoryPointSerializer, UptimeHistoryQuerySerializer,
+)
 from .tasks import generate_report
 
 
@@ -31,8 +42,14 @@ class ReportView(generics.GenericAPIView):
         report_id: UUID = serializer.validated_data['report_id']
         # first check if the report present in the database (completed)
         try:
-            report = StoreReport.objects.get(report_id=report_id)
-            return Response(self.get_serializer({'status': 'completed', 'report': report.file}).data)
+            # a report missing on a lagging replica is reported as `running` until it shows up
+            with read_from_replica():
+                report = StoreReport.objects.get(report_id=report_id)
+            return Response(self.get_serializer({
+                'status': 'completed',
+                'report': report.file,
+                'download': request.build_absolute_uri(reverse('download_report', args=[report.report_id])),
+            }).data)
         except StoreReport.DoesNotExist:
             result: AsyncResult = AsyncResult(str(report_id))
             # `SUCCESS` means the task completed just after the database check
@@ -40,3 +57,169 @@ class ReportView(generics.GenericAPIView):
                 return Response(self.get_serializer({'status': 'running'}).data)
             else:
                 return Response(self.get_serializer({'status': 'failed'}).data)
+
+
+class ReportRowsView(generics.GenericAPIView):
+    """
+    Rows of a completed report, ordered by store id, optionally only the given `store_id`s. Pages are keyset paginated
+    on the store id, `next` is the url of the following page (`after` the last store id of this page)
+    """
+    serializer_class = StoreReportRowSerializer
+
+    def get(self, request: Request, *args, **kwargs):
+        query_serializer = ReportRowsQuerySerializer(data=request.query_params)
+        query_serializer.is_valid(raise_exception=True)
+        query = query_serializer.validated_data
+
+        with read_from_replica():
+            get_object_or_404(StoreReport, report_id=query['report_id'])
+            rows = StoreReportRow.objects.filter(report_id=query['report_id']).order_by('store_id')
+            if query.get('store_id'):
+                rows = rows.filter(store_id__in=query['store_id'])
+            if query.get('after') is not None:
+                rows = rows.filter(store_id__gt=query['after'])
+            # one more row tells whether there is a next page
+            rows = list(rows[:query['limit'] + 1])
+
+        next_url = None
+        if len(rows) > query['limit']:
+            rows = rows[:query['limit']]
+            params = request.query_params.copy()
+            params['after'] = rows[-1].store_id
+            next_url = request.build_absolute_uri(f'{request.path}?{params.urlencode()}')
+
+        return Response({'results': self.get_serializer(rows, many=True).data, 'next': next_url})
+
+
+class UptimeHistoryView(generics.GenericAPIView):
+    """
+    Business hours uptime per day or month from `start` to `end`, summed over the given `store_id`s and / or the stores
+    of a `timezone` (whole fleet by default), read from the downsampled history (`reports.history`)
+    """
+    serializer_class = UptimeHistoryPointSerializer
+
+    def get(self, request: Request, *args, **kwargs):
+        query_serializer = UptimeHistoryQuerySerializer(data=request.query_params)
+        query_serializer.is_valid(raise_exception=True)
+        query = query_serializer.validated_data
+
+        with read_from_replica():
+            resolution, points = get_history(
+                query['start'],
+                query['end'],
+                timezone.now().date(),
+                store_ids=query.get('store_id'),
+                timezone_str=query.get('timezone'),
+                resolution=query.get('resolution'),
+            )
+        return Response({'resolution': resolution, 'results': self.get_serializer(points, many=True).data})
+
+
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def _accepts_gzip(request) -> bool:
+    for encoding in request.headers.get('Accept-Encoding', '').split(','):
+        name, *params = encoding.split(';')
+        if name.strip().lower() != 'gzip':
+            continue
+        for param in params:
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    return float(value) > 0
+                except ValueError:
+                    return False
+        return True
+    return False
+
+
+def _parse_range(range_header: str, size: int) -> 'tuple[int, int] | None':
+    """
+    `(start, end)` (inclusive) of a single byte range, `None` if the range is not supported (multiple ranges) and the
+    whole file should be sent, `ValueError` if the range can not be satisfied
+    """
+    match = RANGE_RE.match(range_header.strip())
+    if not match:
+        return None
+    start, end = match.groups()
+    if not start:
+        # suffix range, last `end` bytes
+        if not end or int(end) == 0:
+            raise ValueError
+        return max(size - int(end), 0), size - 1
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        raise ValueError
+    return start, end
+
+
+def _iter_file(f, start: int, length: int):
+    try:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(DOWNLOAD_CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+
+class ReportDownloadView(View):
+    """
+    Stream the csv file of a completed report, gzipped for clients accepting it. Responses carry a strong ETag (content
+    hash), repeated downloads get `304` with `If-None-Match`, interrupted downloads resume with `Range` (and `If-Range`)
+    """
+
+    def get(self, request, report_id: UUID):
+        with read_from_replica():
+            report = get_object_or_404(StoreReport, report_id=report_id)
+        report.prepare_download()
+
+        gzipped = _accepts_gzip(request)
+        if gzipped:
+            file, etag = report.gzip_file, f'"{report.content_hash}-gzip"'
+        else:
+            file, etag = report.file, f'"{report.content_hash}"'
+
+        headers = {'ETag': etag, 'Accept-Ranges': 'bytes', 'Vary': 'Accept-Encoding'}
+        if_none_match = request.headers.get('If-None-Match')
+        if if_none_match and (
+                if_none_match.strip() == '*' or etag in [tag.strip() for tag in if_none_match.split(',')]
+        ):
+            return HttpResponseNotModified(headers=headers)
+
+        headers['Content-Disposition'] = f'attachment; filename="{report_id}.csv"'
+        if gzipped:
+            headers['Content-Encoding'] = 'gzip'
+
+        size = file.size
+        byte_range = None
+        range_header = request.headers.get('Range')
+        # a partial copy of another version (or encoding) can not be resumed, send the whole file
+        if range_header and request.headers.get('If-Range', etag) == etag:
+            try:
+                byte_range = _parse_range(range_header, size)
+            except ValueError:
+                return HttpResponse(status=416, headers={**headers, 'Content-Range': f'bytes */{size}'})
+
+        f = file.open('rb')
+        if byte_range is None:
+            # FileResponse sets the Content-Disposition itself, from the name of the (possibly gzip) file unless given
+            response = FileResponse(
+                f, content_type='text/csv', headers=headers, as_attachment=True, filename=f'{report_id}.csv'
+            )
+            response.block_size = DOWNLOAD_CHUNK_SIZE
+            return response
+
+        start, end = byte_range
+        return StreamingHttpResponse(
+            _iter_file(f, start, end - start + 1),
+            status=206,
+            content_type='text/csv',
+            headers={**headers, 'Content-Range': f'bytes {start}-{end}/{size}', 'Content-Length': str(end - start + 1)},
+        )
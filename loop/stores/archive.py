@@ -0,0 +1,239 @@
+"""
+Columnar archive of closed `StoreStatus` weeks (Monday 00:00 UTC to next Monday), one directory per week:
+
+- `store_ids`: int64, archived store ids in ascending order
+- `offsets`: int64, `len(store_ids) + 1` row offsets, rows of `store_ids[i]` are `offsets[i]:offsets[i + 1]`
+- `timestamps`: int64, microseconds since the unix epoch, ordered by store id then timestamp
+- `is_active`: one byte (0 / 1) per row
+
+Arrays are in native byte order. They are read through `mmap` with zero copies, only the weeks of the stores actually
+read are converted to `(timestamp_utc, is_active)` tuples.
+"""
+import mmap
+import os
+import shutil
+from array import array
+from bisect import bisect_left, bisect_right
+from collections.abc import Sequence
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from loop.db_routers import merge_shards
+from stores.models import StoreStatus
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+WEEK = timedelta(weeks=1)
+
+ARCHIVE_FILES = ('store_ids', 'offsets', 'timestamps', 'is_active')
+
+# rows buffered in memory before being appended to the files
+WRITE_BUFFER_SIZE = 100_000
+
+
+def to_epoch(value: datetime) -> int:
+    return (value - EPOCH) // timedelta(microseconds=1)
+
+
+def from_epoch(value: int) -> datetime:
+    return EPOCH + timedelta(microseconds=value)
+
+
+def get_week_start(value: datetime) -> datetime:
+    """
+    Start (Monday 00:00 UTC) of the week of the given datetime
+    """
+    value = value.astimezone(timezone.utc)
+    return datetime(value.year, value.month, value.day, tzinfo=timezone.utc) - timedelta(days=value.weekday())
+
+
+def get_week_path(root: 'str | Path', week_start: datetime) -> Path:
+    return Path(root) / week_start.strftime('%Y-%m-%d')
+
+
+def export_week(root: 'str | Path', week_start: datetime) -> int:
+    """
+    Export the statuses of the week starting at week_start, returns the number of rows. Files are written to a
+    temporary directory which then replaces the week directory, readers never see a partial week
+    """
+    path = get_week_path(root, week_start)
+    tmp_path = path.with_name(f'{path.name}.tmp')
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    tmp_path.mkdir(parents=True)
+
+    store_ids = array('q')
+    offsets = array('q')
+    timestamps = array('q')
+    is_active = bytearray()
+    total = 0
+
+    with open(tmp_path / 'timestamps', 'wb') as timestamps_file, open(tmp_path / 'is_active', 'wb') as is_active_file:
+        def flush():
+            timestamps.tofile(timestamps_file)
+            is_active_file.write(is_active)
+            del timestamps[:]
+            del is_active[:]
+
+        def iterate_shard(using: 'str | None'):
+            return StoreStatus.objects.using(using).filter(
+                timestamp_utc__gte=week_start, timestamp_utc__lt=week_start + WEEK,
+            ).order_by('store_id', 'timestamp_utc').values_list('store_id', 'timestamp_utc', 'is_active').iterator(
+                chunk_size=10000
+            )
+
+        # statuses of the shards merged into one store id order
+        for store_id, timestamp_utc, active in merge_shards(iterate_shard, key=lambda row: (row[0], row[1])):
+            if not store_ids or store_ids[-1] != store_id:
+                store_ids.append(store_id)
+                offsets.append(total)
+            timestamps.append(to_epoch(timestamp_utc))
+            is_active.append(active)
+            total += 1
+            if len(timestamps) >= WRITE_BUFFER_SIZE:
+                flush()
+        flush()
+
+    offsets.append(total)
+    with open(tmp_path / 'store_ids', 'wb') as f:
+        store_ids.tofile(f)
+    with open(tmp_path / 'offsets', 'wb') as f:
+        offsets.tofile(f)
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+    return total
+
+
+class WeekArchive:
+    """
+    Memory mapped archive of a week
+    """
+
+    def __init__(self, path: 'str | Path'):
+        self.path = Path(path)
+        self._files = []
+        self._mmaps = []
+        self.store_ids = self._map('store_ids', 'q')
+        self.offsets = self._map('offsets', 'q')
+        self.timestamps = self._map('timestamps', 'q')
+        self.is_active = self._map('is_active', 'B')
+
+    def _map(self, name: str, fmt: str) -> memoryview:
+        f = open(self.path / name, 'rb')
+        self._files.append(f)
+        if os.fstat(f.fileno()).st_size == 0:
+            # empty files can not be mapped
+            return memoryview(b'').cast(fmt)
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._mmaps.append(mapped)
+        return memoryview(mapped).cast(fmt)
+
+    def close(self):
+        for view in (self.store_ids, self.offsets, self.timestamps, self.is_active):
+            view.release()
+        for mapped in self._mmaps:
+            mapped.close()
+        for f in self._files:
+            f.close()
+
+    def store_rows(self, store_id: int, start_datetime: datetime, end_datetime: datetime) -> (int, int):
+        """
+        Row range of the statuses of the store from start_datetime to end_datetime (inclusive)
+        """
+        index = bisect_left(self.store_ids, store_id)
+        if index == len(self.store_ids) or self.store_ids[index] != store_id:
+            return 0, 0
+        lo, hi = self.offsets[index], self.offsets[index + 1]
+        return (
+            bisect_left(self.timestamps, to_epoch(start_datetime), lo, hi),
+            bisect_right(self.timestamps, to_epoch(end_datetime), lo, hi),
+        )
+
+
+class ArchivedStatusList(Sequence):
+    """
+    `(timestamp_utc, is_active)` statuses ordered by timestamp over row ranges of one or more week archives. The rows of
+    a week are converted at once on first access, not one by one on every access. Usable wherever a status list is
+    expected (`reports.utils.accumulate_uptime_downtime`)
+    """
+
+    def __init__(self, segments: 'list[tuple[WeekArchive, int, int]]'):
+        self._segments = [(week, lo, hi) for week, lo, hi in segments if lo < hi]
+        self._statuses: 'list[list[tuple[datetime, bool]] | None]' = [None] * len(self._segments)
+        self._starts = []
+        total = 0
+        for _, lo, hi in self._segments:
+            self._starts.append(total)
+            total += hi - lo
+        self._length = total
+
+    def _segment_statuses(self, segment: int) -> 'list[tuple[datetime, bool]]':
+        statuses = self._statuses[segment]
+        if statuses is None:
+            week, lo, hi = self._segments[segment]
+            statuses = self._statuses[segment] = list(zip(
+                map(from_epoch, week.timestamps[lo:hi]), map(bool, week.is_active[lo:hi])
+            ))
+        return statuses
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        for segment in range(len(self._segments)):
+            yield from self._segment_statuses(segment)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(self)[index]
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError('status index out of range')
+        segment = bisect_right(self._starts, index) - 1
+        return self._segment_statuses(segment)[index - self._starts[segment]]
+
+
+class StatusArchive:
+    """
+    Archive of all the exported weeks under root, weeks are mapped on first use
+    """
+
+    def __init__(self, root: 'str | Path'):
+        self.root = Path(root)
+        self._weeks: 'dict[datetime, WeekArchive | None]' = {}
+
+    def week(self, week_start: datetime) -> 'WeekArchive | None':
+        if week_start not in self._weeks:
+            path = get_week_path(self.root, week_start)
+            self._weeks[week_start] = WeekArchive(path) if path.is_dir() else None
+        return self._weeks[week_start]
+
+    def is_archived(self, start_datetime: datetime, end_datetime: datetime) -> bool:
+        """
+        Whether every week from start_datetime to end_datetime is archived
+        """
+        week_start = get_week_start(start_datetime)
+        while week_start <= end_datetime:
+            if self.week(week_start) is None:
+                return False
+            week_start += WEEK
+        return True
+
+    def status_list(self, store_id: int, start_datetime: datetime, end_datetime: datetime) -> ArchivedStatusList:
+        """
+        Archived statuses of the store from start_datetime to end_datetime (inclusive), weeks not archived are skipped
+        """
+        segments = []
+        week_start = get_week_start(start_datetime)
+        while week_start <= end_datetime:
+            week = self.week(week_start)
+            if week is not None:
+                segments.append((week, *week.store_rows(store_id, start_datetime, end_datetime)))
+            week_start += WEEK
+        return ArchivedStatusList(segments)
+
+    def close(self):
+        for week in self._weeks.values():
+            if week is not None:
+                week.close()
+        self._weeks.clear()
@@ -0,0 +1,228 @@
+import csv
+import gzip
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from datetime import time
+from itertools import islice
+from typing import Callable, Iterator, TextIO
+
+from django.conf import settings
+from django.db import connections, router, transaction
+
+from loop.db_routers import split_by_shard
+
+from stores.models import Store, StoreBusinessHour, StoreStatus
+from stores.utils import normalize_business_hours, validate_timezone
+from ._import_store import import_store
+
+STORES = 'stores'
+BUSINESS_HOURS = 'business_hours'
+STORE_STATUSES = 'store_statuses'
+
+# dependency order, stores must exist before their business hours and statuses
+IMPORT_ORDER = [STORES, BUSINESS_HOURS, STORE_STATUSES]
+
+
+def open_csv(path: str) -> TextIO:
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', newline='')
+    return open(path, 'r', newline='')
+
+
+def parse_store_row(row: dict) -> tuple:
+    return int(row['store_id']), row['timezone_str']
+
+
+def parse_business_hour_row(row: dict) -> tuple:
+    return (
+        int(row['store_id']), int(row['day']),
+        time.fromisoformat(row['start_time_local']), time.fromisoformat(row['end_time_local']),
+    )
+
+
+def parse_store_status_row(row: dict) -> tuple:
+    return int(row['store_id']), row['timestamp_utc'], row['status'] == 'active'
+
+
+# sqlite has a single writer per database, and the shared cache in memory database of the tests fails with table locks
+# instead of waiting for it, loaders take turns writing to it
+_sqlite_write_locks = {alias: threading.Lock() for alias in settings.DATABASES}
+
+
+def write_lock(using: 'str | None'):
+    """
+    Lock held while writing to the database `using` (default routing if not given), only for sqlite
+    """
+    using = using or router.db_for_write(Store)
+    return _sqlite_write_locks[using] if connections[using].vendor == 'sqlite' else nullcontext()
+
+
+def load_stores(rows: 'list[tuple]'):
+    # `bulk_create` skips `Store.save`, validate each distinct timezone once
+    for timezone_str in {timezone_str for _, timezone_str in rows}:
+        validate_timezone(timezone_str)
+    # rows of each store go to its shard (`loop.db_routers.get_store_shard`)
+    for using, shard_rows in split_by_shard(rows, lambda row: row[0]).items():
+        with write_lock(using):
+            Store.objects.using(using).bulk_create([
+                Store(store_id=store_id, timezone_str=timezone_str)
+                for store_id, timezone_str in shard_rows
+            ])
+
+
+def load_business_hours(rows: 'list[tuple]'):
+    """
+    Merge the rows with the business hours already stored for their stores, and replace them with the normalized
+    schedule (`stores.utils.normalize_business_hours`). The rows of a store can be spread over several chunks
+    """
+    for using, shard_rows in split_by_shard(rows, lambda row: row[0]).items():
+        store_ids = sorted({row[0] for row in shard_rows})
+        with write_lock(using), transaction.atomic(using=using):
+            import_store(store_ids, using)
+            # chunks of the same stores loaded by other threads wait for this one, in store order to avoid deadlocks
+            list(
+                Store.objects.using(using).select_for_update().filter(store_id__in=store_ids)
+                .order_by('store_id').values_list('pk')
+            )
+            stored = StoreBusinessHour.objects.using(using).filter(store_id__in=store_ids)
+            business_hours = normalize_business_hours([
+                *stored.values_list('store_id', 'day', 'start_time_local', 'end_time_local'),
+                *shard_rows,
+            ])
+            stored.delete()
+            StoreBusinessHour.objects.using(using).bulk_create([
+                StoreBusinessHour(
+                    store_id=store_id, day=day, start_time_local=start_time_local, end_time_local=end_time_local
+                )
+                for store_id, day, start_time_local, end_time_local in business_hours
+            ])
+
+
+def load_store_statuses(rows: 'list[tuple]'):
+    for using, shard_rows in split_by_shard(rows, lambda row: row[0]).items():
+        with write_lock(using):
+            import_store([row[0] for row in shard_rows], using)
+            StoreStatus.objects.using(using).bulk_create([
+                StoreStatus(store_id=store_id, timestamp_utc=timestamp_utc, is_active=is_active)
+                for store_id, timestamp_utc, is_active in shard_rows
+            ])
+
+
+PARSERS: 'dict[str, Callable[[dict], tuple]]' = {
+    STORES: parse_store_row,
+    BUSINESS_HOURS: parse_business_hour_row,
+    STORE_STATUSES: parse_store_status_row,
+}
+
+LOADERS: 'dict[str, Callable[[list[tuple]], None]]' = {
+    STORES: load_stores,
+    BUSINESS_HOURS: load_business_hours,
+    STORE_STATUSES: load_store_statuses,
+}
+
+
+def read_csv(kind: str, path: str) -> 'list[tuple]':
+    with open_csv(path) as f:
+        return [PARSERS[kind](row) for row in csv.DictReader(f)]
+
+
+def iter_line_chunks(paths: 'list[str]', chunk_size: int) -> 'Iterator[tuple[str, list[str]]]':
+    """
+    Raw `(header, lines)` chunks of the given files, splitting lines is cheap, parsing them is left to the workers
+    """
+    for path in paths:
+        with open_csv(path) as f:
+            header = f.readline()
+            while True:
+                lines = list(islice(f, chunk_size))
+                if not lines:
+                    break
+                yield header, lines
+
+
+def parse_chunk(kind: str, header: str, lines: 'list[str]') -> 'list[tuple]':
+    """
+    Parse a chunk of csv lines to plain tuples, runs in the parser processes
+    """
+    return [PARSERS[kind](row) for row in csv.DictReader([header, *lines])]
+
+
+class ImportPipeline:
+    """
+    Parse csv files in a process pool and write the parsed chunks through `loaders` threads, each with its own database
+    connection. Parsed chunks are handed over through a queue of `queue_size` chunks, so a slow database applies back
+    pressure to the parsers instead of piling up parsed rows in memory
+    """
+
+    def __init__(self, processes: int, loaders: int, chunk_size: int, queue_size: int):
+        self.processes = processes
+        self.loaders = loaders
+        self.chunk_size = chunk_size
+        self.queue_size = queue_size
+
+    def _loader(self, kind: str, chunks: 'queue.Queue[list[tuple] | None]', errors: 'list[BaseException]'):
+        try:
+            while True:
+                rows = chunks.get()
+                if rows is None:
+                    return
+                # keep draining after an error, so the parser stage is not blocked on a full queue
+                if not errors:
+                    try:
+                        LOADERS[kind](rows)
+                    except BaseException as e:
+                        errors.append(e)
+        finally:
+            # connections of this thread, to the default database or the shards
+            connections.close_all()
+
+    def run(self, kind: str, paths: 'list[str]', executor: ProcessPoolExecutor) -> int:
+        """
+        Import all the files of one kind, returns when every row is written
+        """
+        chunks: 'queue.Queue[list[tuple] | None]' = queue.Queue(maxsize=self.queue_size)
+        errors: 'list[BaseException]' = []
+        threads = [
+            threading.Thread(target=self._loader, args=(kind, chunks, errors), name=f'{kind}-loader-{i}')
+            for i in range(self.loaders)
+        ]
+        for thread in threads:
+            thread.start()
+
+        total = 0
+        pending = deque()
+        try:
+            for header, lines in iter_line_chunks(paths, self.chunk_size):
+                pending.append(executor.submit(parse_chunk, kind, header, lines))
+                # bound the chunks being parsed
+                if len(pending) >= 2 * self.processes:
+                    rows = pending.popleft().result()
+                    total += len(rows)
+                    chunks.put(rows)
+            while pending:
+                rows = pending.popleft().result()
+                total += len(rows)
+                chunks.put(rows)
+        finally:
+            for _ in threads:
+                chunks.put(None)
+            for thread in threads:
+                thread.join()
+
+        if errors:
+            raise errors[0]
+        return total
+
+    def run_all(self, paths: 'dict[str, list[str]]') -> 'dict[str, int]':
+        """
+        Import the files of every kind, one kind after the other in dependency order
+        """
+        totals = {}
+        with ProcessPoolExecutor(max_workers=self.processes) as executor:
+            for kind in IMPORT_ORDER:
+                if paths.get(kind):
+                    totals[kind] = self.run(kind, paths[kind], executor)
+        return totals
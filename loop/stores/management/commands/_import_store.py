@@ -1,11 +1,15 @@
 from stores.models import Store
 
 
-def import_store(store_ids: 'list[int]'):
-    Store.objects.bulk_create([
+def import_store(store_ids: 'list[int]', using: 'str | None' = None):
+    """
+    Create the stores missing from the database `using` (default routing if not given), which must be their shard
+    """
+    Store.objects.using(using).bulk_create([
         Store(
             store_id=store_id,
             # ... other required fields
         )
-        for store_id in store_ids
+        # unique and sorted, so concurrent loaders insert (and lock) the same stores in the same order
+        for store_id in sorted(set(store_ids))
     ], ignore_conflicts=True)
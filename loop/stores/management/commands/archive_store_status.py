@@ -0,0 +1,46 @@
+from datetime import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from loop.db_routers import get_store_shards
+from stores.archive import WEEK, export_week, get_week_path, get_week_start
+from stores.models import StoreStatus
+
+
+class Command(BaseCommand):
+    help = 'Export closed weeks of store statuses to the columnar archive (STATUS_ARCHIVE_ROOT)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--before', type=datetime.fromisoformat,
+            help='archive the weeks ending before this datetime (ISO format, UTC if naive), defaults to now',
+        )
+        parser.add_argument('--overwrite', action='store_true', help='export the weeks already archived again')
+
+    def handle(self, *args, **options):
+        before = options['before'] or timezone.now()
+        if timezone.is_naive(before):
+            before = timezone.make_aware(before, timezone.utc)
+
+        first_statuses = [
+            StoreStatus.objects.using(using).order_by('timestamp_utc').values_list('timestamp_utc', flat=True).first()
+            for using in get_store_shards()
+        ]
+        first_status = min(filter(None, first_statuses), default=None)
+        if first_status is None:
+            self.stdout.write(self.style.SUCCESS('No store status to archive'))
+            return
+
+        exported = 0
+        week_start = get_week_start(first_status)
+        # only closed weeks, no status can be added to them anymore
+        while week_start + WEEK <= before:
+            if options['overwrite'] or not get_week_path(settings.STATUS_ARCHIVE_ROOT, week_start).is_dir():
+                total = export_week(settings.STATUS_ARCHIVE_ROOT, week_start)
+                exported += 1
+                self.stdout.write(f'Archived week {week_start.date()}: {total} statuses')
+            week_start += WEEK
+
+        self.stdout.write(self.style.SUCCESS(f'Successfully archived {exported} weeks'))
@@ -1,9 +1,6 @@
-import csv
-
 from django.core.management.base import BaseCommand
 
-from stores.models import StoreStatus
-from ._import_store import import_store
+from ._csv_import import LOADERS, STORE_STATUSES, read_csv
 
 
 class Command(BaseCommand):
@@ -13,22 +10,7 @@ class Command(BaseCommand):
     def handle(self, *args, **options):
         csv_file = options['file']
 
-        models = []
-        store_ids = []
-        with open(csv_file, 'r') as f:
-            csv_reader = csv.DictReader(f)
-            for row in csv_reader:
-                store_id = int(row['store_id'])
-                store_ids.append(store_id)
-                models.append(
-                    StoreStatus(
-                        store_id=store_id,
-                        timestamp_utc=row['timestamp_utc'],
-                        is_active=row['status'] == 'active',
-                    )
-                )
-
-        import_store(store_ids)
-        StoreStatus.objects.bulk_create(models)
+        rows = read_csv(STORE_STATUSES, csv_file)
+        LOADERS[STORE_STATUSES](rows)
         self.stdout.write(self.style.SUCCESS(f'Successfully imported store status: {csv_file}'))
-        self.stdout.write(self.style.SUCCESS(f'Total: {len(models)}'))
+        self.stdout.write(self.style.SUCCESS(f'Total: {len(rows)}'))
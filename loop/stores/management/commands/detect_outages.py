@@ -0,0 +1,90 @@
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from loop.db_routers import get_store_shards
+from stores.models import Store, StoreBusinessHour, StoreStatus
+from stores.outages import StatusTail, get_outage_detector
+from stores.utils import StoreBusinessHourHelper
+
+
+class Command(BaseCommand):
+    help = (
+        'Tail incoming store statuses and alert fleet wide outages (OUTAGE_* settings). Statuses committed more than '
+        '--overlap seconds after their insertion are missed'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=1, help='seconds between two polls of new statuses')
+        parser.add_argument('--batch-size', type=int, default=10000, help='statuses read per query')
+        parser.add_argument(
+            '--after-id', type=int,
+            help='start after this status id (of every shard), defaults to the statuses of the last window only',
+        )
+        parser.add_argument(
+            '--overlap', type=float, default=30,
+            help='seconds statuses are read again for, catching the ones committed out of id order',
+        )
+        parser.add_argument('--once', action='store_true', help='process the pending statuses and exit')
+
+    def handle(self, *args, **options):
+        detector = get_outage_detector()
+        self.register_helpers(detector)
+
+        # status ids are only ordered within a database, each shard is tailed on its own
+        tails = [
+            StatusTail(
+                using,
+                self.get_start_id(using, detector) if options['after_id'] is None else options['after_id'],
+                options['overlap'],
+                options['batch_size'],
+            )
+            for using in get_store_shards()
+        ]
+
+        total = 0
+        while True:
+            for tail in tails:
+                for store_id, timestamp_utc, is_active in tail.read():
+                    detector.observe(store_id, timestamp_utc, is_active)
+                    total += 1
+            # groups without new statuses recover as their window empties
+            detector.advance(timezone.now())
+
+            if options['once']:
+                break
+            time.sleep(options['interval'])
+
+        last_ids_str = ', '.join(f'{tail.using or "default"}: {tail.last_id}' for tail in tails)
+        self.stdout.write(self.style.SUCCESS(f'Processed {total} statuses, last ids {last_ids_str}'))
+
+    def get_start_id(self, using: 'str | None', detector) -> int:
+        """
+        Id before the first status of the last window
+        """
+        statuses = StoreStatus.objects.using(using)
+        window_start = timezone.now() - timedelta(seconds=detector.bucket_count * detector.bucket_seconds)
+        first_id = statuses.filter(timestamp_utc__gte=window_start).order_by('id').values_list('id', flat=True).first()
+        if first_id is not None:
+            return first_id - 1
+        return statuses.order_by('-id').values_list('id', flat=True).first() or 0
+
+    def register_helpers(self, detector):
+        """
+        Business hours of every store in two queries (per shard), instead of one per store on its first status
+        """
+        for using in get_store_shards():
+            business_hours: 'dict[int, list[dict]]' = defaultdict(list)
+            for b_hour in StoreBusinessHour.objects.using(using).order_by('store_id', 'day', 'start_time_local') \
+                    .values('store_id', 'day', 'start_time_local', 'end_time_local'):
+                business_hours[b_hour.pop('store_id')].append(b_hour)
+
+            for store_id, timezone_str in Store.objects.using(using).values_list('store_id', 'timezone_str') \
+                    .iterator(chunk_size=10000):
+                detector.register(StoreBusinessHourHelper(
+                    store=Store(store_id=store_id, timezone_str=timezone_str),
+                    business_hours=business_hours.pop(store_id, []),
+                ))
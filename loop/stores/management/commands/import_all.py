@@ -0,0 +1,64 @@
+import os
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from ._csv_import import BUSINESS_HOURS, IMPORT_ORDER, STORE_STATUSES, STORES, ImportPipeline
+
+# file names in a directory, possibly sharded (`store-status-0001.csv`) and gzipped (`store-status.csv.gz`)
+FILE_PATTERNS = {
+    STORES: re.compile(r'^store-timezone.*\.csv(\.gz)?$'),
+    BUSINESS_HOURS: re.compile(r'^store-hours.*\.csv(\.gz)?$'),
+    STORE_STATUSES: re.compile(r'^store-status.*\.csv(\.gz)?$'),
+}
+
+
+class Command(BaseCommand):
+    help = 'Import stores, business hours and store statuses, parsing in parallel and writing through several ' \
+           'database connections'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stores', nargs='+', default=[], help='store timezone csv files')
+        parser.add_argument('--business-hours', nargs='+', default=[], help='store business hours csv files')
+        parser.add_argument('--statuses', nargs='+', default=[], help='store status csv files')
+        parser.add_argument(
+            '--directory', type=str,
+            help='directory of store-timezone*.csv, store-hours*.csv and store-status*.csv files (optionally .gz)',
+        )
+        parser.add_argument('--processes', type=int, default=os.cpu_count(), help='parser processes')
+        parser.add_argument('--loaders', type=int, default=4, help='database writer threads (connections)')
+        parser.add_argument('--chunk-size', type=int, default=10000, help='rows per parsed chunk')
+        parser.add_argument('--queue-size', type=int, default=8, help='parsed chunks waiting to be written')
+
+    def handle(self, *args, **options):
+        paths = {
+            STORES: options['stores'],
+            BUSINESS_HOURS: options['business_hours'],
+            STORE_STATUSES: options['statuses'],
+        }
+        if options['directory']:
+            for file_name in sorted(os.listdir(options['directory'])):
+                for kind, pattern in FILE_PATTERNS.items():
+                    if pattern.match(file_name):
+                        paths[kind].append(os.path.join(options['directory'], file_name))
+
+        if not any(paths.values()):
+            raise CommandError('No files to import')
+
+        # forked parser processes must not share the database connections
+        connections.close_all()
+
+        pipeline = ImportPipeline(
+            processes=options['processes'],
+            loaders=options['loaders'],
+            chunk_size=options['chunk_size'],
+            queue_size=options['queue_size'],
+        )
+        totals = pipeline.run_all(paths)
+        for kind in IMPORT_ORDER:
+            if kind in totals:
+                self.stdout.write(self.style.SUCCESS(
+                    f'Successfully imported {kind.replace("_", " ")}: {len(paths[kind])} files'
+                ))
+                self.stdout.write(self.style.SUCCESS(f'Total: {totals[kind]}'))
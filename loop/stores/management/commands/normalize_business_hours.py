@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from loop.db_routers import get_store_shards
+from stores.models import StoreBusinessHour
+from ._csv_import import BUSINESS_HOURS, LOADERS
+
+
+class Command(BaseCommand):
+    help = 'Merge the business hours imported before the import normalized them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help='stores normalized per transaction')
+
+    def handle(self, *args, **options):
+        before = after = 0
+        for using in get_store_shards():
+            business_hours = StoreBusinessHour.objects.using(using)
+            before += business_hours.count()
+            store_ids = list(business_hours.order_by('store_id').values_list('store_id', flat=True).distinct())
+            for i in range(0, len(store_ids), options['chunk_size']):
+                rows = list(
+                    business_hours.filter(store_id__in=store_ids[i:i + options['chunk_size']])
+                    .values_list('store_id', 'day', 'start_time_local', 'end_time_local')
+                )
+                # the loader merges the rows with themselves, leaving the normalized schedule
+                LOADERS[BUSINESS_HOURS](rows)
+            after += business_hours.count()
+
+        self.stdout.write(self.style.SUCCESS(f'Successfully normalized business hours: {before} -> {after} rows'))
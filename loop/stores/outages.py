@@ -0,0 +1,274 @@
+"""
+Streaming outage detection over incoming store statuses.
+
+Every status within the business hours of its store is counted in sliding window counters of the store and of its
+timezone group. A counter is a ring of time buckets, updates are O(1) (amortized over the buckets of the window) and its
+memory is fixed, so the detector is bounded by the number of stores and timezones, not by the status rate. An alert is
+sent to the sink when the inactive ratio of a group (or a store) goes above the threshold, and again when it recovers.
+"""
+import logging
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Callable, Iterator
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from loop.db_routers import get_store_shard
+from stores.models import Store, StoreStatus
+from stores.utils import StoreBusinessHourHelper
+
+logger = logging.getLogger(__name__)
+
+TIMEZONE = 'timezone'
+STORE = 'store'
+
+
+class Alert:
+    def __init__(self, kind: str, key: 'str | int', inactive_ratio: float, total: int, timestamp: datetime,
+                 recovered: bool):
+        self.kind = kind
+        self.key = key
+        self.inactive_ratio = inactive_ratio
+        self.total = total
+        self.timestamp = timestamp
+        self.recovered = recovered
+
+    def __str__(self):
+        state = 'recovered' if self.recovered else 'outage'
+        return f'{state} {self.kind} {self.key}: {self.inactive_ratio:.0%} inactive of {self.total} at {self.timestamp}'
+
+
+class AlertSink:
+    def emit(self, alert: Alert):
+        raise NotImplementedError
+
+
+class LoggingAlertSink(AlertSink):
+    def emit(self, alert: Alert):
+        if alert.recovered:
+            logger.info(str(alert))
+        else:
+            logger.warning(str(alert))
+
+
+class WindowCounter:
+    """
+    Active / inactive counts over the last `bucket_count` buckets
+    """
+    __slots__ = ('bucket_indexes', 'active', 'inactive', 'total_active', 'total_inactive', 'current_index')
+
+    def __init__(self, bucket_count: int):
+        self.bucket_indexes = [-1] * bucket_count
+        self.active = [0] * bucket_count
+        self.inactive = [0] * bucket_count
+        self.total_active = 0
+        self.total_inactive = 0
+        self.current_index = -1
+
+    def advance(self, current_index: int):
+        """
+        Move the window to end at current_index, dropping the buckets out of it. The buckets entering the window take
+        the slots of the ones leaving it, only these slots are cleared
+        """
+        if current_index <= self.current_index:
+            return
+        bucket_count = len(self.bucket_indexes)
+        for bucket_index in range(max(self.current_index + 1, current_index - bucket_count + 1), current_index + 1):
+            slot = bucket_index % bucket_count
+            if self.bucket_indexes[slot] != -1:
+                self.total_active -= self.active[slot]
+                self.total_inactive -= self.inactive[slot]
+                self.bucket_indexes[slot] = -1
+                self.active[slot] = 0
+                self.inactive[slot] = 0
+        self.current_index = current_index
+
+    def add(self, bucket_index: int, is_active: bool, current_index: int):
+        """
+        Count a status of the bucket bucket_index, which must be within the window ending at current_index
+        """
+        self.advance(current_index)
+        # buckets of the window map to distinct slots, the slot is either empty or already this bucket
+        slot = bucket_index % len(self.bucket_indexes)
+        self.bucket_indexes[slot] = bucket_index
+        if is_active:
+            self.active[slot] += 1
+            self.total_active += 1
+        else:
+            self.inactive[slot] += 1
+            self.total_inactive += 1
+
+    @property
+    def total(self) -> int:
+        return self.total_active + self.total_inactive
+
+    @property
+    def inactive_ratio(self) -> float:
+        return self.total_inactive / self.total if self.total else 0
+
+
+class OutageDetector:
+    """
+    Feed statuses with `observe`, in (roughly) timestamp order, statuses older than the window are ignored
+    """
+
+    def __init__(
+            self,
+            sink: AlertSink,
+            window: timedelta,
+            bucket: timedelta,
+            threshold: float,
+            min_statuses: int,
+            store_threshold: 'float | None' = None,
+            store_min_statuses: int = 1,
+            helper_loader: 'Callable[[int], StoreBusinessHourHelper] | None' = None,
+    ):
+        self.sink = sink
+        self.bucket_seconds = bucket.total_seconds()
+        self.bucket_count = max(1, round(window / bucket))
+        self.threshold = threshold
+        self.min_statuses = min_statuses
+        self.store_threshold = store_threshold
+        self.store_min_statuses = store_min_statuses
+        self.helper_loader = helper_loader or (
+            lambda store_id: StoreBusinessHourHelper(Store.objects.using(get_store_shard(store_id)).get(pk=store_id))
+        )
+
+        self.helpers: 'dict[int, StoreBusinessHourHelper]' = {}
+        self.store_counters: 'dict[int, WindowCounter]' = {}
+        self.timezone_counters: 'dict[str, WindowCounter]' = {}
+        # (kind, key) in outage
+        self.outages: 'set[tuple[str, str | int]]' = set()
+        self.last_bucket_index = 0
+
+    def register(self, helper: StoreBusinessHourHelper):
+        """
+        Register the business hours of a store ahead of its statuses (bulk loading), otherwise loaded on first status
+        """
+        self.helpers[helper.store.store_id] = helper
+
+    def _bucket_index(self, timestamp: datetime) -> int:
+        return int(timestamp.timestamp() // self.bucket_seconds)
+
+    def _check(self, kind: str, key: 'str | int', counter: WindowCounter, threshold: float, min_statuses: int,
+               timestamp: datetime):
+        in_outage = (kind, key) in self.outages
+        if not in_outage and counter.total >= min_statuses and counter.inactive_ratio > threshold:
+            self.outages.add((kind, key))
+            self.sink.emit(Alert(kind, key, counter.inactive_ratio, counter.total, timestamp, recovered=False))
+        elif in_outage and (counter.total < min_statuses or counter.inactive_ratio <= threshold):
+            self.outages.discard((kind, key))
+            self.sink.emit(Alert(kind, key, counter.inactive_ratio, counter.total, timestamp, recovered=True))
+
+    def observe(self, store_id: int, timestamp: datetime, is_active: bool):
+        bucket_index = self._bucket_index(timestamp)
+        if bucket_index <= self.last_bucket_index - self.bucket_count:
+            # older than the window
+            return
+
+        helper = self.helpers.get(store_id)
+        if helper is None:
+            helper = self.helpers[store_id] = self.helper_loader(store_id)
+        if not helper.is_open(timestamp):
+            return
+
+        if bucket_index > self.last_bucket_index:
+            self.advance(timestamp)
+
+        timezone_str = helper.store.timezone_str
+        timezone_counter = self.timezone_counters.get(timezone_str)
+        if timezone_counter is None:
+            timezone_counter = self.timezone_counters[timezone_str] = WindowCounter(self.bucket_count)
+        timezone_counter.add(bucket_index, is_active, self.last_bucket_index)
+        self._check(TIMEZONE, timezone_str, timezone_counter, self.threshold, self.min_statuses, timestamp)
+
+        if self.store_threshold is not None:
+            store_counter = self.store_counters.get(store_id)
+            if store_counter is None:
+                store_counter = self.store_counters[store_id] = WindowCounter(self.bucket_count)
+            store_counter.add(bucket_index, is_active, self.last_bucket_index)
+            self._check(STORE, store_id, store_counter, self.store_threshold, self.store_min_statuses, timestamp)
+
+    def advance(self, now: datetime):
+        """
+        Move the window to now, groups which stopped receiving statuses recover once their window is empty. Store
+        counters are only moved when they get a status, store outages are cleared by their next status
+        """
+        bucket_index = self._bucket_index(now)
+        if bucket_index <= self.last_bucket_index:
+            return
+        self.last_bucket_index = bucket_index
+        for timezone_str, counter in self.timezone_counters.items():
+            counter.advance(bucket_index)
+            self._check(TIMEZONE, timezone_str, counter, self.threshold, self.min_statuses, now)
+
+
+class StatusTail:
+    """
+    New statuses of one database in id order. Ids are taken when a status is inserted but only visible once its
+    transaction commits, so with concurrent loaders a lower id can appear after higher ones were read. Every read
+    starts again from the last id known to have no gap below it, the ids read in the last `overlap` seconds are skipped
+    as duplicates. Statuses committed more than `overlap` seconds after their insertion are still missed
+    """
+
+    def __init__(self, using: 'str | None', after_id: int, overlap: float, batch_size: int):
+        self.using = using
+        # every id up to the cursor is read
+        self.cursor = after_id
+        self.last_id = after_id
+        self.overlap = overlap
+        self.batch_size = batch_size
+        # ids read above the cursor, and the (monotonic) time of each read with the last id it reached
+        self.read_ids: 'set[int]' = set()
+        self.reads: 'deque[tuple[float, int]]' = deque()
+
+    def read(self) -> 'Iterator[tuple[int, datetime, bool]]':
+        """
+        Statuses not read yet as `(store_id, timestamp_utc, is_active)`, queried `batch_size` at a time
+        """
+        started = time.monotonic()
+        last_id = self.cursor
+        while True:
+            batch = list(
+                StoreStatus.objects.using(self.using).filter(id__gt=last_id).order_by('id')
+                .values_list('id', 'store_id', 'timestamp_utc', 'is_active')[:self.batch_size]
+            )
+            for status_id, store_id, timestamp_utc, is_active in batch:
+                if status_id not in self.read_ids:
+                    self.read_ids.add(status_id)
+                    yield store_id, timestamp_utc, is_active
+            if batch:
+                last_id = batch[-1][0]
+            if len(batch) < self.batch_size:
+                break
+
+        if last_id > self.last_id:
+            self.last_id = last_id
+            self.reads.append((started, last_id))
+        # the ids below one reached `overlap` seconds before this read were taken earlier, so they are committed and
+        # this read got them
+        cursor = self.cursor
+        while self.reads and self.reads[0][0] <= started - self.overlap:
+            _, cursor = self.reads.popleft()
+        if cursor > self.cursor:
+            self.cursor = cursor
+            self.read_ids = {status_id for status_id in self.read_ids if status_id > cursor}
+
+
+def get_outage_detector(**kwargs) -> OutageDetector:
+    """
+    Detector configured from the `OUTAGE_*` settings, `kwargs` override them
+    """
+    options = {
+        'sink': import_string(settings.OUTAGE_ALERT_SINK)(),
+        'window': timedelta(seconds=settings.OUTAGE_WINDOW_SECONDS),
+        'bucket': timedelta(seconds=settings.OUTAGE_BUCKET_SECONDS),
+        'threshold': settings.OUTAGE_THRESHOLD,
+        'min_statuses': settings.OUTAGE_MIN_STATUSES,
+        'store_threshold': settings.OUTAGE_STORE_THRESHOLD,
+        'store_min_statuses': settings.OUTAGE_STORE_MIN_STATUSES,
+    }
+    options.update(kwargs)
+    return OutageDetector(**options)
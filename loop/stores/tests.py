@@ -1,8 +1,28 @@
-from django.test import TestCase
+import gzip
+import io
+import os
+import tempfile
+from datetime import date, datetime, time, timedelta
+from typing import Callable
+
+from django.core.management import call_command
+from django.db.models import QuerySet
+from django.test import TestCase, TransactionTestCase
 from django.utils import timezone
 
-from .models import Store, StoreBusinessHour
-from .utils import StoreBusinessHourHelper
+from .archive import StatusArchive, export_week
+from .models import Store, StoreBusinessHour, StoreStatus
+from .outages import TIMEZONE, AlertSink, OutageDetector, StatusTail, WindowCounter
+from .utils import StoreBusinessHourHelper, get_timezone, get_timezone_offsets, normalize_business_hours
+
+
+def set_status_timestamps(statuses: 'QuerySet[StoreStatus]', timestamp: 'Callable[[int], datetime]'):
+    """
+    Set the timestamp of the i-th of `statuses` (by id) to `timestamp(i)`, `auto_now_add` timestamps can only be set
+    with an update
+    """
+    for i, status_id in enumerate(statuses.order_by('id').values_list('id', flat=True)):
+        statuses.filter(id=status_id).update(timestamp_utc=timestamp(i))
 
 
 class TestBusinessHourGenerator(TestCase):
@@ -52,3 +72,215 @@ class TestBusinessHourGenerator(TestCase):
         # check case when store is open one day of the week and closed the other
         hours = list(self.store_one_day_helper.shifts_generator(start_datetime, end_datetime))
         self.assertEqual(len(hours), 1)
+
+
+    def test_overnight_east_of_utc(self):
+        # 22:00 - 02:00 every day in India, the 00:00 - 02:00 half is on the previous UTC day (18:30 - 20:30)
+        business_hours = normalize_business_hours([(4, day, time(22), time(2)) for day in range(7)])
+        helper = StoreBusinessHourHelper(
+            Store(store_id=4, timezone_str='Asia/Kolkata'),
+            [{'day': day, 'start_time_local': start, 'end_time_local': end} for _, day, start, end in business_hours],
+        )
+        tz = get_timezone('Asia/Kolkata')
+        start_datetime = datetime(2024, 1, 1, tzinfo=tz).astimezone(timezone.utc)
+        end_datetime = start_datetime + timedelta(weeks=1)
+        open_time = sum(
+            (
+                min(shift.end_datetime, end_datetime) - max(shift.start_datetime, start_datetime)
+                for shift in helper.shifts_generator(start_datetime, end_datetime)
+            ),
+            timedelta(),
+        )
+        self.assertAlmostEqual(open_time.total_seconds(), 28 * 3600, places=3)
+        self.assertTrue(helper.is_open(datetime(2024, 1, 3, 1, tzinfo=tz).astimezone(timezone.utc)))
+        self.assertFalse(helper.is_open(datetime(2024, 1, 3, 3, tzinfo=tz).astimezone(timezone.utc)))
+
+class TestTimezoneOffsets(TestCase):
+    def test_to_utc(self):
+        offsets = get_timezone_offsets('America/Chicago')
+        self.assertIs(offsets, get_timezone_offsets('America/Chicago'))
+
+        tz = get_timezone('America/Chicago')
+        # regular day, 2023-03-12 (spring forward) and 2023-11-05 (fall back)
+        for day in (date(2023, 1, 10), date(2023, 3, 12), date(2023, 11, 5)):
+            for local_time in (time(0, 30), time(1, 30), time(2, 30), time(9, 0), time(23, 59, 59)):
+                self.assertEqual(
+                    offsets.to_utc(day, local_time),
+                    datetime.combine(day, local_time, tz).astimezone(timezone.utc),
+                )
+        self.assertIsNone(offsets.day_offset(date(2023, 3, 12)))
+        self.assertEqual(offsets.day_offset(date(2023, 1, 10)), timedelta(hours=-6))
+
+
+class TestImportAll(TransactionTestCase):
+    def test_import_directory(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with open(os.path.join(directory, 'store-timezone.csv'), 'w') as f:
+                f.write('store_id,timezone_str\n1,Asia/Kolkata\n2,UTC\n')
+            with open(os.path.join(directory, 'store-hours.csv'), 'w') as f:
+                f.write('store_id,day,start_time_local,end_time_local\n1,0,08:00:00,10:00:00\n')
+            # sharded and gzipped, store 3 is only known from its statuses
+            for shard, store_ids in enumerate([(1, 2), (2, 3)]):
+                with gzip.open(os.path.join(directory, f'store-status-{shard}.csv.gz'), 'wt') as f:
+                    f.write('store_id,status,timestamp_utc\n')
+                    for store_id in store_ids:
+                        f.write(f'{store_id},active,2023-01-24 09:00:00+00:00\n')
+
+            call_command(
+                'import_all', directory=directory, processes=2, loaders=2, chunk_size=1, stdout=io.StringIO()
+            )
+
+        self.assertEqual(Store.objects.get(store_id=1).timezone_str, 'Asia/Kolkata')
+        self.assertEqual(Store.objects.get(store_id=3).timezone_str, 'America/Chicago')
+        self.assertEqual(StoreBusinessHour.objects.count(), 1)
+        self.assertEqual(StoreStatus.objects.count(), 4)
+
+    def test_normalize_business_hours(self):
+        self.assertEqual(
+            normalize_business_hours([
+                (1, 0, time(9), time(12)),
+                (1, 0, time(11), time(14)),
+                (1, 0, time(14), time(15)),
+                (1, 0, time(9), time(12)),
+                (1, 0, time(18), time(20)),
+                # overnight, sunday wraps to monday
+                (1, 6, time(22), time(2)),
+                (2, 1, time(8), time(8)),
+            ]),
+            [
+                (1, 0, time(0), time(2)),
+                (1, 0, time(9), time(15)),
+                (1, 0, time(18), time(20)),
+                (1, 6, time(22), time(23, 59, 59, 999999)),
+                (2, 1, time(0), time(23, 59, 59, 999999)),
+            ],
+        )
+
+        # rows of a store spread over chunks are merged with the stored ones
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'store-hours.csv')
+            with open(path, 'w') as f:
+                f.write('store_id,day,start_time_local,end_time_local\n')
+                f.write('1,0,09:00:00,12:00:00\n1,2,22:00:00,01:00:00\n1,0,10:00:00,13:00:00\n1,0,09:00:00,12:00:00\n')
+            call_command('import_all', business_hours=[path], processes=1, loaders=1, chunk_size=1, stdout=io.StringIO())
+
+        self.assertEqual(
+            list(StoreBusinessHour.objects.order_by('day', 'start_time_local').values_list(
+                'day', 'start_time_local', 'end_time_local'
+            )),
+            [(0, time(9), time(13)), (2, time(22), time(23, 59, 59, 999999)), (3, time(0), time(1))],
+        )
+
+
+class TestStatusArchive(TestCase):
+    def test_export_and_read(self):
+        Store.objects.create(**{'store_id': 1, 'timezone_str': 'UTC'})
+        Store.objects.create(**{'store_id': 2, 'timezone_str': 'UTC'})
+        StoreStatus.objects.bulk_create([StoreStatus(store_id=1 + i % 2, is_active=i % 3 == 0) for i in range(40)])
+        # spread over two weeks
+        start_datetime = datetime(2023, 1, 16, 0, 0, 0, 123456, tzinfo=timezone.utc)
+        set_status_timestamps(StoreStatus.objects.all(), lambda i: start_datetime + timedelta(hours=9 * i))
+
+        with tempfile.TemporaryDirectory() as root:
+            self.assertEqual(export_week(root, start_datetime.replace(microsecond=0)), 19)
+            self.assertEqual(export_week(root, datetime(2023, 1, 23, tzinfo=timezone.utc)), 19)
+
+            archive = StatusArchive(root)
+            range_start = datetime(2023, 1, 18, tzinfo=timezone.utc)
+            range_end = datetime(2023, 1, 26, 12, tzinfo=timezone.utc)
+            self.assertTrue(archive.is_archived(range_start, range_end))
+            for store_id in (1, 2, 3):
+                self.assertEqual(
+                    list(archive.status_list(store_id, range_start, range_end)),
+                    list(
+                        StoreStatus.objects
+                        .filter(store_id=store_id, timestamp_utc__gte=range_start, timestamp_utc__lte=range_end)
+                        .order_by('timestamp_utc').values_list('timestamp_utc', 'is_active')
+                    ),
+                )
+            status_list = archive.status_list(1, range_start, range_end)
+            self.assertEqual(status_list[-1], list(status_list)[-1])
+            self.assertEqual(status_list[2:4], list(status_list)[2:4])
+            archive.close()
+
+
+class CollectingAlertSink(AlertSink):
+    def __init__(self):
+        self.alerts = []
+
+    def emit(self, alert):
+        self.alerts.append(alert)
+
+
+class TestOutageDetector(TestCase):
+    def test_timezone_outage(self):
+        sink = CollectingAlertSink()
+        detector = OutageDetector(
+            sink, window=timedelta(minutes=1), bucket=timedelta(seconds=10), threshold=0.5, min_statuses=4,
+            helper_loader=lambda store_id: self.fail('helpers are registered'),
+        )
+        monday_hours = [{'day': 0, 'start_time_local': time(9), 'end_time_local': time(17)}]
+        for store_id in range(1, 6):
+            detector.register(StoreBusinessHourHelper(Store(store_id=store_id, timezone_str='UTC'), monday_hours))
+
+        # monday after closing, not counted
+        closed = datetime(2024, 1, 1, 20, tzinfo=timezone.utc)
+        for store_id in range(1, 6):
+            detector.observe(store_id, closed, False)
+        self.assertEqual(sink.alerts, [])
+
+        opened = datetime(2024, 1, 1, 10, tzinfo=timezone.utc)
+        detector = OutageDetector(
+            sink, window=timedelta(minutes=1), bucket=timedelta(seconds=10), threshold=0.5, min_statuses=4,
+            store_threshold=0.5,
+        )
+        for store_id in range(1, 6):
+            detector.register(StoreBusinessHourHelper(Store(store_id=store_id, timezone_str='UTC'), monday_hours))
+        detector.observe(1, opened, True)
+        detector.observe(2, opened + timedelta(seconds=5), False)
+        detector.observe(3, opened + timedelta(seconds=15), False)
+        # store outages of 2 and 3, not enough statuses for the group yet
+        self.assertEqual([(alert.kind, alert.key) for alert in sink.alerts], [('store', 2), ('store', 3)])
+        detector.observe(4, opened + timedelta(seconds=20), False)
+        self.assertEqual([(alert.kind, alert.key) for alert in sink.alerts[2:]], [(TIMEZONE, 'UTC'), ('store', 4)])
+        self.assertEqual((sink.alerts[2].total, sink.alerts[2].inactive_ratio), (4, 0.75))
+        # older than the window, ignored
+        detector.observe(5, opened - timedelta(minutes=5), True)
+        self.assertEqual(detector.timezone_counters['UTC'].total, 4)
+
+        # window moved past the statuses, the group recovers
+        detector.advance(opened + timedelta(minutes=2))
+        self.assertTrue(sink.alerts[-1].recovered)
+        self.assertEqual(detector.timezone_counters['UTC'].total, 0)
+        self.assertEqual((sink.alerts[-1].kind, len(sink.alerts)), (TIMEZONE, 5))
+
+    def test_window_counter(self):
+        counter = WindowCounter(bucket_count=3)
+        counter.add(10, False, 10)
+        counter.add(11, True, 11)
+        counter.add(12, False, 12)
+        self.assertEqual((counter.total_active, counter.total_inactive), (1, 2))
+        # bucket 10 leaves the window, only its slot is cleared
+        counter.advance(13)
+        self.assertEqual((counter.total_active, counter.total_inactive), (1, 1))
+        self.assertEqual(sorted(counter.bucket_indexes), [-1, 11, 12])
+        # far ahead, every bucket leaves the window
+        counter.advance(100)
+        self.assertEqual((counter.total, counter.bucket_indexes), (0, [-1, -1, -1]))
+
+    def test_status_tail(self):
+        Store.objects.create(**{'store_id': 1, 'timezone_str': 'UTC'})
+        StoreStatus.objects.bulk_create([StoreStatus(id=status_id, store_id=1, is_active=True) for status_id in (1, 3)])
+        tail = StatusTail(None, after_id=0, overlap=60, batch_size=1)
+        self.assertEqual(len(list(tail.read())), 2)
+        # status 2 committed after 3 was read, read once without reading 1 and 3 again
+        StoreStatus.objects.create(id=2, store_id=1, is_active=False)
+        self.assertEqual([is_active for _, _, is_active in tail.read()], [False])
+        self.assertEqual((tail.cursor, tail.last_id), (0, 3))
+
+        # past the overlap the read ids are final, later statuses are read after them
+        tail.overlap = 0
+        self.assertEqual(list(tail.read()), [])
+        self.assertEqual((tail.cursor, tail.read_ids), (3, set()))
+        StoreStatus.objects.create(id=4, store_id=1, is_active=True)
+        self.assertEqual(len(list(tail.read())), 1)
@@ -1,7 +1,10 @@
+import zoneinfo
 from collections import defaultdict
-from datetime import datetime, time, timedelta
-from typing import TYPE_CHECKING, Iterator
+from datetime import date, datetime, time, timedelta, tzinfo
+from functools import lru_cache
+from typing import TYPE_CHECKING, Iterable, Iterator
 
+from django.core.exceptions import ValidationError
 from django.utils import timezone
 
 if TYPE_CHECKING:
@@ -13,6 +16,123 @@ DAY_START = time(0, 0, tzinfo=timezone.utc)
 DAY_END = time(23, 59, 59, 999999, tzinfo=timezone.utc)
 
 
+@lru_cache(maxsize=None)
+def get_timezone(timezone_str: str) -> zoneinfo.ZoneInfo:
+    """
+    Process wide registry of timezones, a single `ZoneInfo` per timezone string
+    """
+    return zoneinfo.ZoneInfo(timezone_str)
+
+
+def validate_timezone(timezone_str: str):
+    try:
+        get_timezone(timezone_str)
+    except zoneinfo.ZoneInfoNotFoundError:
+        raise ValidationError(f'Invalid timezone: {timezone_str}')
+
+
+class TimezoneOffsets:
+    """
+    UTC offsets of a timezone per local day, shared by all the stores of the timezone. Converting the local business
+    hours of a day to UTC is then a subtraction, `ZoneInfo` is only consulted once per day, and on DST transition days
+    """
+
+    def __init__(self, tz: tzinfo):
+        self.timezone = tz
+        self._day_offsets: 'dict[date, timedelta | None]' = {}
+
+    def day_offset(self, day: date) -> 'timedelta | None':
+        """
+        UTC offset of the whole day, `None` if the offset changes during the day (DST transition)
+        """
+        try:
+            return self._day_offsets[day]
+        except KeyError:
+            start_offset = datetime.combine(day, time.min, self.timezone).utcoffset()
+            end_offset = datetime.combine(day, time.max, self.timezone).utcoffset()
+            offset = self._day_offsets[day] = start_offset if start_offset == end_offset else None
+            return offset
+
+    def prepare(self, start_date: date, end_date: date):
+        """
+        Compute the offsets of all days from start_date to end_date ahead of time
+        """
+        day = start_date
+        while day <= end_date:
+            self.day_offset(day)
+            day += timedelta(days=1)
+
+    def to_utc(self, day: date, local_time: time) -> datetime:
+        """
+        UTC datetime of the (naive) local time on the given day
+        """
+        offset = self.day_offset(day)
+        if offset is None:
+            return datetime.combine(day, local_time, self.timezone).astimezone(timezone.utc)
+        return datetime.combine(day, local_time, timezone.utc) - offset
+
+
+@lru_cache(maxsize=None)
+def get_timezone_offsets(timezone_str: str) -> TimezoneOffsets:
+    return TimezoneOffsets(get_timezone(timezone_str))
+
+
+def group_stores_by_timezone(stores: 'Iterable[tuple[int, str]]') -> 'dict[str, list[int]]':
+    """
+    Group `(store_id, timezone_str)` by timezone, so per timezone work is done once for all of its stores
+    """
+    stores_by_timezone: 'dict[str, list[int]]' = defaultdict(list)
+    for store_id, timezone_str in stores:
+        stores_by_timezone[timezone_str].append(store_id)
+    return stores_by_timezone
+
+
+def prepare_timezone_offsets(timezone_strs: 'Iterable[str]', start_date: date, end_date: date):
+    """
+    Compute the UTC offsets of each timezone (and UTC, used by always open stores) from start_date to end_date once
+    """
+    for timezone_str in {'UTC', *timezone_strs}:
+        get_timezone_offsets(timezone_str).prepare(start_date, end_date)
+
+
+# end of a local day as stored, `TimeField` has no 24:00
+LOCAL_DAY_END = time(23, 59, 59, 999999)
+
+
+def normalize_business_hours(
+        business_hours: 'Iterable[tuple[int, int, time, time]]'
+) -> 'list[tuple[int, int, time, time]]':
+    """
+    Minimal schedule of `(store_id, day, start_time_local, end_time_local)` business hours: overlapping, touching and
+    duplicate hours of a store's day are merged. Overnight hours (end before start) are split into the end of their day
+    and the start of the next one (Sunday wraps to Monday), equal start and end is open the whole day. Sorted by store,
+    day and start time
+    """
+    days: 'dict[tuple[int, int], list[tuple[time, time]]]' = defaultdict(list)
+    for store_id, day, start_time_local, end_time_local in business_hours:
+        if start_time_local < end_time_local:
+            days[store_id, day].append((start_time_local, end_time_local))
+        elif start_time_local == end_time_local:
+            days[store_id, day].append((time.min, LOCAL_DAY_END))
+        else:
+            days[store_id, day].append((start_time_local, LOCAL_DAY_END))
+            if end_time_local != time.min:
+                days[store_id, (day + 1) % 7].append((time.min, end_time_local))
+
+    normalized = []
+    for (store_id, day), hours in sorted(days.items()):
+        hours.sort()
+        start_time_local, end_time_local = hours[0]
+        for start, end in hours[1:]:
+            if start <= end_time_local:
+                end_time_local = max(end_time_local, end)
+            else:
+                normalized.append((store_id, day, start_time_local, end_time_local))
+                start_time_local, end_time_local = start, end
+        normalized.append((store_id, day, start_time_local, end_time_local))
+    return normalized
+
+
 class StoreBusinessHourHelper:
     """
     Helper class to handle the business hours of a store
@@ -43,49 +163,79 @@ class StoreBusinessHourHelper:
 
     class StoreShift:
         def __init__(self, start_datetime: datetime, end_datetime: datetime):
+            # shifts are in UTC, so a shift of a local day can span two UTC days
             assert start_datetime < end_datetime
-            assert start_datetime.weekday() == end_datetime.weekday()
             self.start_datetime = start_datetime
             self.end_datetime = end_datetime
 
-    def __init__(self, store: 'Store'):
+    def __init__(self, store: 'Store', business_hours: 'Iterable[dict] | None' = None):
+        """
+        `business_hours` can be passed as already loaded `day`, `start_time_local`, `end_time_local` dicts ordered by
+        day and start time, to avoid querying the database (bulk loading, worker processes)
+        """
         self.store = store
         self.always_open = True
         self.business_hours: 'dict[int, list[StoreBusinessHourHelper.BusinessHour]]' = defaultdict(list)
 
-        for b_hour in store.business_hours.order_by('day', 'start_time_local') \
-                .values('day', 'start_time_local', 'end_time_local'):
+        if business_hours is None:
+            business_hours = store.business_hours.order_by('day', 'start_time_local') \
+                .values('day', 'start_time_local', 'end_time_local')
+
+        store_timezone = store.timezone
+        for b_hour in business_hours:
             self.always_open = False
             self.business_hours[b_hour['day']].append(
                 StoreBusinessHourHelper.BusinessHour(
-                    b_hour['start_time_local'].replace(tzinfo=store.timezone),
-                    b_hour['end_time_local'].replace(tzinfo=store.timezone),
+                    b_hour['start_time_local'].replace(tzinfo=store_timezone),
+                    b_hour['end_time_local'].replace(tzinfo=store_timezone),
                     b_hour['day']
                 )
             )
 
+        # always open stores are open for the whole UTC day
+        self.timezone_offsets = get_timezone_offsets('UTC' if self.always_open else store.timezone_str)
+
         if self.always_open:
             for weekday in range(7):
                 self.business_hours[weekday].append(
                     StoreBusinessHourHelper.BusinessHour(DAY_START, DAY_END, weekday)
                 )
 
+        # shifts of the last day checked by `is_open`
+        self._open_day: 'date | None' = None
+        self._open_shifts: 'list[StoreBusinessHourHelper.StoreShift]' = []
+
     def shifts_generator(
             self, start_datetime: datetime, end_datetime: datetime
     ) -> 'Iterator[StoreBusinessHourHelper.StoreShift]':
         """
-        Generate all shifts between start_datetime and end_datetime
+        Generate all shifts overlapping start_datetime to end_datetime (whole, not clipped), ordered by start. Local days
+        are walked from the day before the local start date, the shifts of a local day can start on the previous UTC day
+        (stores east of UTC) or end on the next one (stores west of UTC)
         """
-        curr_datetime = start_datetime
-        while curr_datetime <= end_datetime:
-            for business_hour in self.business_hours[curr_datetime.weekday()]:
-                shift_start_datetime = datetime.combine(curr_datetime.date(), business_hour.start_time)
-                shift_end_datetime = datetime.combine(curr_datetime.date(), business_hour.end_time)
-                if curr_datetime <= shift_end_datetime:
+        timezone_offsets = self.timezone_offsets
+        day = start_datetime.astimezone(timezone_offsets.timezone).date() - timedelta(days=1)
+        end_day = end_datetime.astimezone(timezone_offsets.timezone).date()
+        while day <= end_day:
+            for business_hour in self.business_hours[day.weekday()]:
+                shift_start_datetime = timezone_offsets.to_utc(day, business_hour.start_time.replace(tzinfo=None))
+                shift_end_datetime = timezone_offsets.to_utc(day, business_hour.end_time.replace(tzinfo=None))
+                if shift_end_datetime >= start_datetime and shift_start_datetime <= end_datetime:
                     yield StoreBusinessHourHelper.StoreShift(shift_start_datetime, shift_end_datetime)
-                    curr_datetime = shift_end_datetime
+            day += timedelta(days=1)
 
-            curr_datetime = datetime.combine(curr_datetime.date(), DAY_START) + timedelta(days=1)
+    def is_open(self, timestamp: datetime) -> bool:
+        """
+        Whether the (UTC) timestamp is within a shift, the shifts overlapping a UTC day are generated once for all the
+        timestamps of that day
+        """
+        day = timestamp.date()
+        if self._open_day != day:
+            self._open_day = day
+            self._open_shifts = list(self.shifts_generator(
+                datetime.combine(day, DAY_START), datetime.combine(day, DAY_END)
+            ))
+        return any(shift.start_datetime <= timestamp <= shift.end_datetime for shift in self._open_shifts)
 
     def __str__(self):
         return f"{self.store} - {self.business_hours} - {self.always_open}"